@@ -0,0 +1,68 @@
+"""
+Время цикла опроса серверов (poll_servers из fetch_server_info) и задержка кика (kickPlayer)
+на локальных фейковых серверах из benchmarks.simulator.
+
+Запуск: python -m benchmarks.bench_poller [--servers 50] [--players 8] [--latency 20] [--loss 0.01] [--dead 2]
+"""
+from benchmarks.simulator import Simulator, FakeServer, makeServers
+from src.celery.tasks import poll_servers
+from src.lib.rcon_api import kickPlayer, toSteam64
+from src.database.sourcebans import SbServer
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+
+def pollCycle(fake: list[FakeServer], servers: list[SbServer]) -> tuple[float, int]:
+    """
+    Опрашивает серверы так же, как fetch_server_info. Возвращает (время, количество ответивших)
+    """
+    start = time.perf_counter()
+    results = asyncio.run(poll_servers(servers))
+    elapsed = time.perf_counter() - start
+    for server, result in zip(fake, results):
+        if result is None: continue
+        result, _ = result
+        assert result['playersCount'] == len(server.players)
+        assert {p['steamId'] for p in result['players']} == {toSteam64(p.steam2id) for p in server.players}
+    return elapsed, sum(r is not None for r in results)
+
+def kickLatency(fake: list[FakeServer], servers: list[SbServer], rng: random.Random) -> float:
+    server = rng.choice([s for s in fake if not s.dead and len(s.players) > 0])
+    player = rng.choice(server.players)
+    start = time.perf_counter()
+    asyncio.run(kickPlayer(servers, player.steam2id))
+    elapsed = time.perf_counter() - start
+    assert player not in server.players, 'player was not kicked'
+    return elapsed
+
+def summary(values: list[float]) -> str:
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f'median: {statistics.median(values) * 1000:.1f} ms  p95: {p95 * 1000:.1f} ms  max: {values[-1] * 1000:.1f} ms'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', type=int, default=20)
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--port', type=int, default=27100)
+    parser.add_argument('--latency', type=float, default=5, help='response delay, ms')
+    parser.add_argument('--loss', type=float, default=0)
+    parser.add_argument('--dead', type=int, default=0)
+    parser.add_argument('--mtu', type=int, default=1248)
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--kicks', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    fake = makeServers(args.servers, args.players, args.port, args.latency / 1000, args.loss, args.dead, args.mtu)
+    with Simulator(fake) as sim:
+        servers = sim.sbServers()
+        cycles = [pollCycle(fake, servers) for _ in range(args.cycles)]
+        print(f'poll cycle ({args.servers} servers, {args.dead} dead, loss {args.loss}):')
+        print(f'  {summary([c[0] for c in cycles])}  answered: {min(c[1] for c in cycles)}-{max(c[1] for c in cycles)}')
+        kicks = [kickLatency(fake, servers, rng) for _ in range(args.kicks)]
+        print(f'kick latency:\n  {summary(kicks)}')
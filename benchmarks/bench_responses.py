@@ -0,0 +1,85 @@
+"""
+Сравнение старого и нового пути отдачи кэшированных ответов для /score/top и /profile/bulk.
+
+old: json.loads(кэш) -> валидация response_model -> jsonable_encoder -> JSONResponse
+new: кэш отдается как есть (cachedResponse), приложение по умолчанию использует ORJSONResponse
+
+Запуск: python -m benchmarks.bench_responses [количество запросов]
+"""
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+from src.types import api_models as Schemas
+from src.api.tools import cachedResponse
+import datetime
+import json
+import sys
+import time
+
+steamInfo = {
+    'steamid': '76561198086700922',
+    'communityvisibilitystate': 3,
+    'profilestate': 1,
+    'personaname': 'player',
+    'commentpermission': 1,
+    'profileurl': 'https://steamcommunity.com/id/player/',
+    'avatar': 'https://avatars.steamstatic.com/0000000000000000000000000000000000000000.jpg',
+    'avatarmedium': 'https://avatars.steamstatic.com/0000000000000000000000000000000000000000_medium.jpg',
+    'avatarfull': 'https://avatars.steamstatic.com/0000000000000000000000000000000000000000_full.jpg',
+    'avatarhash': '0000000000000000000000000000000000000000',
+    'lastlogoff': 1724000000,
+    'personastate': 0,
+    'primaryclanid': '103582791429521408',
+    'timecreated': 1360000000,
+    'personastateflags': 0,
+    'loccountrycode': 'RU',
+}
+
+top = [{'rank': i + 1, 'steamId': str(76561198000000000 + i), 'score': 100000 - i, 'steamInfo': steamInfo} for i in range(100)]
+
+bulk = {
+    'steamInfo': steamInfo,
+    'rank': 12,
+    'balance': 15000,
+    'perks': {k: 'perk' for k in Schemas.PerkSet.model_fields},
+    'privileges': [
+        {
+            'id': i,
+            'activeUntil': datetime.datetime(2030, 1, 1).isoformat(),
+            'user': {'id': 2, 'steamId': steamInfo['steamid']},
+            'privilege': {'id': i, 'name': 'vip', 'accessLevel': 4, 'description': 'VIP features'}
+        }
+        for i in range(10)
+    ],
+    'discordId': 123456789012345678
+}
+
+cache = {'top': json.dumps(top), 'bulk': Schemas.BulkProfileInfo.model_validate(bulk).model_dump_json()}
+
+old = FastAPI()
+@old.get('/score/top', response_model=None)
+def old_top(): return json.loads(cache['top'])
+@old.get('/profile/bulk', response_model=Schemas.BulkProfileInfo)
+def old_bulk(): return json.loads(cache['bulk'])
+
+new = FastAPI(default_response_class=ORJSONResponse)
+@new.get('/score/top', response_model=None)
+def new_top(): return cachedResponse(cache['top'])
+@new.get('/profile/bulk', response_model=Schemas.BulkProfileInfo)
+def new_bulk(): return cachedResponse(cache['bulk'])
+
+
+def measure(client: TestClient, path: str, count: int) -> float:
+    for _ in range(count // 10): client.get(path)
+    start = time.perf_counter()
+    for _ in range(count): client.get(path)
+    return (time.perf_counter() - start) / count * 1000
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    oldClient, newClient = TestClient(old), TestClient(new)
+    for path in ('/score/top', '/profile/bulk'):
+        assert oldClient.get(path).json() == newClient.get(path).json()
+        o, n = measure(oldClient, path, count), measure(newClient, path, count)
+        print(f'{path:16} old: {o:.3f} ms  new: {n:.3f} ms  x{o / n:.2f}')
@@ -0,0 +1,296 @@
+"""
+Локальные A2S (UDP) и Source RCON (TCP) серверы вместо настоящих серверов L4D2.
+
+Каждый фейковый сервер слушает UDP и TCP на одном порту (как srcds) и поддерживает:
+- A2S_INFO / A2S_PLAYER с challenge и разбиением больших ответов на несколько пакетов
+- RCON авторизацию, `status` (в формате L4D2, его разбирает rcon_api.playersRegex) и `sm_kick #userid`
+- задержку ответа, потерю UDP пакетов и "мертвые" серверы, которые не отвечают совсем
+
+Запуск: python -m benchmarks.simulator --servers 50 --players 8 --latency 20 --dead 2
+"""
+from dataclasses import dataclass, field
+from src.database.sourcebans import SbServer
+import argparse
+import asyncio
+import random
+import struct
+import threading
+import time
+
+HEADER_SIMPLE = b'\xFF\xFF\xFF\xFF'
+HEADER_MULTI = b'\xFE\xFF\xFF\xFF'
+
+A2S_INFO = 0x54
+A2S_PLAYER = 0x55
+S2C_CHALLENGE = 0x41
+INFO_RESPONSE = 0x49
+PLAYER_RESPONSE = 0x44
+
+RCON_AUTH = 3
+RCON_AUTH_RESPONSE = 2
+RCON_EXECCOMMAND = 2
+RCON_RESPONSE_VALUE = 0
+
+L4D2_APPID = 550
+
+NAMES = ['Ellis', 'Nick', 'Rochelle', 'Coach', 'Зоуи', 'Фрэнсис', 'Луис', 'Билл', 'Tank', 'Witch', 'Smoker', 'Боец']
+
+
+@dataclass
+class FakePlayer:
+    userid: int
+    name: str
+    steam2id: str
+    ip: str
+    score: int
+    joined: float = field(default_factory=time.monotonic)
+
+    @property
+    def duration(self) -> float:
+        return time.monotonic() - self.joined
+
+
+@dataclass
+class FakeServer:
+    sid: int
+    port: int
+    name: str
+    map: str = 'c2m1_highway'
+    maxPlayers: int = 8
+    players: list[FakePlayer] = field(default_factory=list)
+    rcon: str = 'rcon'
+    latency: float = 0.0
+    loss: float = 0.0
+    dead: bool = False
+    mtu: int = 1248
+    challenge: int = field(default_factory=lambda: random.getrandbits(31))
+    keywords: str = 'coop,vortex'
+    nextUserId: int = 2
+
+    def addPlayer(self, name: str, steam2id: str, ip: str = '10.0.0.2') -> FakePlayer:
+        player = FakePlayer(self.nextUserId, name, steam2id, ip, random.randint(0, 50))
+        self.nextUserId += 1
+        self.players.append(player)
+        return player
+
+    def kick(self, userid: int) -> FakePlayer | None:
+        for p in self.players:
+            if p.userid != userid: continue
+            self.players.remove(p)
+            return p
+        return None
+
+    def sbServer(self, host: str = '127.0.0.1') -> SbServer:
+        return SbServer(sid=self.sid, ip=host, port=self.port, rcon=self.rcon, modid=0, enabled=1)
+
+
+def cstring(value: str) -> bytes:
+    return value.encode() + b'\x00'
+
+def infoResponse(server: FakeServer) -> bytes:
+    edf = 0x80 | 0x20 | 0x01
+    return HEADER_SIMPLE + bytes([INFO_RESPONSE, 17]) \
+        + cstring(server.name) + cstring(server.map) + cstring('left4dead2') + cstring('Left 4 Dead 2') \
+        + struct.pack('<H', L4D2_APPID) + bytes([len(server.players), server.maxPlayers, 0]) \
+        + b'dl' + bytes([0, 1]) + cstring('2.2.4.3') \
+        + bytes([edf]) + struct.pack('<H', server.port) + cstring(server.keywords) + struct.pack('<Q', L4D2_APPID)
+
+def playersResponse(server: FakeServer) -> bytes:
+    data = HEADER_SIMPLE + bytes([PLAYER_RESPONSE, len(server.players)])
+    for p in server.players:
+        data += b'\x00' + cstring(p.name) + struct.pack('<if', p.score, p.duration)
+    return data
+
+def statusResponse(server: FakeServer, host: str) -> str:
+    lines = [
+        f'hostname: {server.name}',
+        'version : 2.2.4.3 9078 secure  (unknown)',
+        f'udp/ip  : {host}:{server.port} [ public n/a ]',
+        'os      : Linux Dedicated',
+        f'map     : {server.map}',
+        f'players : {len(server.players)} humans, 0 bots ({server.maxPlayers} max) (not hibernating) (unreserved)',
+        '',
+        '# userid name uniqueid connected ping loss state rate adr',
+    ]
+    for i, p in enumerate(server.players):
+        minutes, seconds = divmod(int(p.duration), 60)
+        lines.append(f'# {p.userid} {i + 1} "{p.name}" {p.steam2id} {minutes:02}:{seconds:02} {random.randint(20, 90)} 0 active 30000 {p.ip}:27005')
+    lines.append('#end')
+    return '\n'.join(lines) + '\n'
+
+def splitPacket(packet: bytes, mtu: int, messageId: int) -> list[bytes]:
+    """
+    Разбиение ответа на пакеты в формате Source (без сжатия)
+    """
+    if len(packet) <= mtu: return [packet]
+    chunks = [packet[i:i + mtu] for i in range(0, len(packet), mtu)]
+    return [
+        HEADER_MULTI + struct.pack('<IBBH', messageId, len(chunks), n, mtu) + chunk
+        for n, chunk in enumerate(chunks)
+    ]
+
+
+class A2SProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.messageId = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def __send(self, packet: bytes, addr):
+        self.messageId += 1
+        for part in splitPacket(packet, self.server.mtu, self.messageId):
+            # Каждый пакет теряется независимо, как в реальной сети
+            if random.random() < self.server.loss: continue
+            asyncio.get_running_loop().call_later(self.server.latency, self.transport.sendto, part, addr)
+
+    def __challenge(self, addr):
+        self.__send(HEADER_SIMPLE + bytes([S2C_CHALLENGE]) + struct.pack('<i', self.server.challenge), addr)
+
+    def datagram_received(self, data: bytes, addr):
+        if self.server.dead or not data.startswith(HEADER_SIMPLE) or len(data) < 5: return
+        if random.random() < self.server.loss: return
+        kind, payload = data[4], data[5:]
+        if kind == A2S_INFO:
+            query = b'Source Engine Query\x00'
+            if not payload.startswith(query): return
+            challenge = payload[len(query):]
+            if len(challenge) != 4 or struct.unpack('<i', challenge)[0] != self.server.challenge:
+                return self.__challenge(addr)
+            self.__send(infoResponse(self.server), addr)
+        elif kind == A2S_PLAYER:
+            if len(payload) != 4 or struct.unpack('<i', payload)[0] != self.server.challenge:
+                return self.__challenge(addr)
+            self.__send(playersResponse(self.server), addr)
+
+
+def rconPacket(requestId: int, kind: int, body: str) -> bytes:
+    payload = struct.pack('<ii', requestId, kind) + body.encode() + b'\x00\x00'
+    return struct.pack('<i', len(payload)) + payload
+
+async def rconHandler(server: FakeServer, host: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    authorized = False
+    try:
+        while True:
+            size = struct.unpack('<i', await reader.readexactly(4))[0]
+            data = await reader.readexactly(size)
+            requestId, kind = struct.unpack('<ii', data[:8])
+            body = data[8:-2].decode(errors='replace')
+            await asyncio.sleep(server.latency)
+            if kind == RCON_AUTH:
+                authorized = body == server.rcon
+                # srcds перед AUTH_RESPONSE шлет пустой RESPONSE_VALUE. Синхронный rcon.Client читает каждый пакет
+                # через новый буферизованный makefile и теряет второй пакет, если они пришли вместе, поэтому он пропущен
+                writer.write(rconPacket(requestId if authorized else -1, RCON_AUTH_RESPONSE, ''))
+            elif kind == RCON_EXECCOMMAND and authorized:
+                writer.write(rconPacket(requestId, RCON_RESPONSE_VALUE, rconCommand(server, host, body)))
+            else:
+                break
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+def rconCommand(server: FakeServer, host: str, line: str) -> str:
+    command, _, args = line.strip().partition(' ')
+    if command == '': return ''
+    if command == 'status': return statusResponse(server, host)
+    if command == 'sm_kick':
+        target = args.split(' ', 1)[0]
+        if target.startswith('#') and target[1:].isdigit() and (p := server.kick(int(target[1:]))) is not None:
+            return f'[SM] Kicked "{p.name}".\n'
+        return '[SM] No matching client was found.\n'
+    return f'Unknown command "{command}"\n'
+
+
+def randomSteam2id(rng: random.Random) -> str:
+    return f'STEAM_1:{rng.randint(0, 1)}:{rng.randint(10_000, 600_000_000)}'
+
+def makeServers(count: int, players: int = 8, basePort: int = 27100, latency: float = 0.0,
+                loss: float = 0.0, dead: int = 0, mtu: int = 1248, seed: int = 0) -> list[FakeServer]:
+    """
+    `dead` последних серверов не отвечают. Состав игроков детерминирован для одного `seed`
+    """
+    rng = random.Random(seed)
+    servers = []
+    for i in range(count):
+        server = FakeServer(
+            sid=i + 1, port=basePort + i, name=f'Vortex #{i + 1}',
+            maxPlayers=max(8, players), latency=latency, loss=loss, dead=i >= count - dead, mtu=mtu
+        )
+        for n in range(players):
+            server.addPlayer(f'{rng.choice(NAMES)} {i + 1}-{n + 1}', randomSteam2id(rng), f'10.{i % 256}.{n}.{rng.randint(2, 254)}')
+        servers.append(server)
+    return servers
+
+
+class Simulator:
+    """
+    Поднимает фейковые серверы в отдельном потоке со своим event loop, чтобы их можно было
+    опрашивать синхронным кодом (fetch_server_info) и из asyncio.run (kickPlayer).\n
+    with Simulator(makeServers(50)) as sim:
+        servers = sim.sbServers()
+    """
+    def __init__(self, servers: list[FakeServer], host: str = '127.0.0.1'):
+        self.servers = servers
+        self.host = host
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.closers: list = []
+
+    async def __start(self):
+        for server in self.servers:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda server=server: A2SProtocol(server), local_addr=(self.host, server.port)
+            )
+            self.closers.append(transport.close)
+            # Мертвый сервер не принимает TCP соединения (connection refused)
+            if server.dead: continue
+            tcp = await asyncio.start_server(
+                lambda r, w, server=server: rconHandler(server, self.host, r, w), self.host, server.port
+            )
+            self.closers.append(tcp.close)
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.__start(), self.loop).result()
+
+    def stop(self):
+        async def close():
+            for closer in self.closers: closer()
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def sbServers(self) -> list[SbServer]:
+        return [s.sbServer(self.host) for s in self.servers]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local A2S/RCON stand-in servers')
+    parser.add_argument('--servers', type=int, default=10)
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--port', type=int, default=27100, help='port of the first server')
+    parser.add_argument('--latency', type=float, default=0, help='response delay, ms')
+    parser.add_argument('--loss', type=float, default=0, help='UDP packet loss, 0..1')
+    parser.add_argument('--dead', type=int, default=0, help='number of servers that never answer')
+    parser.add_argument('--mtu', type=int, default=1248, help='A2S responses longer than this are split into packets')
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args()
+    servers = makeServers(args.servers, args.players, args.port, args.latency / 1000, args.loss, args.dead, args.mtu)
+    with Simulator(servers, args.host):
+        for s in servers:
+            print(f'sid={s.sid} {args.host}:{s.port} rcon={s.rcon} players={len(s.players)}{" dead" if s.dead else ""}')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
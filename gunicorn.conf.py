@@ -0,0 +1,8 @@
+# Настройки gunicorn (подхватывается автоматически из рабочей папки, параметры запуска - в CMD Dockerfile)
+from src.lib.metrics import clearMultiprocDir, markProcessDead
+
+def on_starting(server):
+    clearMultiprocDir()
+
+def child_exit(server, worker):
+    markProcessDead(worker.pid)
@@ -1,2 +1,3 @@
-docker compose up -d --build
-docker compose exec l4d2vortexapi alembic upgrade head
\ No newline at end of file
+docker compose build
+docker compose run --rm bootstrap
+docker compose up -d
\ No newline at end of file
@@ -1,17 +1,22 @@
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Request, Response
 from fastapi.responses import JSONResponse
 from src.database import crud as Crud, models as Models
 from src.types import api_models as Schemas
 from sqlalchemy.orm import Session
 from typing import Optional, List, Union
 import datetime
-from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken
-import numpy as np
+from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, RateLimit, getSyncRedis, SyncRedis, checkVersion
+from src.lib.user_versions import BALANCE, bumpVersions
+from src.lib.rate_limit import SlidingWindow
+import random
 
 DROP_COOLDOWN = datetime.timedelta(hours=6)
 DROP_VALUE_MIN = 100
 DROP_VALUE_LOC = 400
 DROP_VALUE_SCALE = 300
+# Игровые серверы проксируют команды всех своих игроков, поэтому лимит по IP намного выше
+DROP_RATE_LIMIT = RateLimit('balance_drop', steamId=SlidingWindow(5, 60), ip=SlidingWindow(600, 60))
+GIVEAWAY_RATE_LIMIT = RateLimit('giveaway_checkout', steamId=SlidingWindow(10, 60), ip=SlidingWindow(600, 60))
 
 balance_api = APIRouter()
 
@@ -25,13 +30,14 @@ def getOrCreateBalance(db: Session, user: Models.User):
 
 
 @balance_api.get('', response_model=Schemas.Balance)
-def get_balance(steam_id: str, db: Session = Depends(get_db)):
+def get_balance(steam_id: str, request: Request, response: Response, db: Session = Depends(get_db), r: SyncRedis = Depends(getSyncRedis)):
+    if (notModified := checkVersion(r, request, response, BALANCE, steam_id)) is not None: return notModified
     user = getUser(db, steam_id)
     balance = getOrCreateBalance(db, user)
     return balance
 
 @balance_api.post('/add', response_model=Schemas.Transaction)
-def add_balance(steam_id: str, value: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def add_balance(steam_id: str, value: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     checkToken(db, token)
     user = getUser(db, steam_id)
     balance = getOrCreateBalance(db, user)
@@ -39,11 +45,12 @@ def add_balance(steam_id: str, value: int, db: Session = Depends(get_db), token:
     transaction = Models.Transaction(balance=balance, value=value, description='add')
     db.add(transaction)
     db.commit()
+    bumpVersions(r, BALANCE, [steam_id])
     db.refresh(transaction)
     return transaction
 
 @balance_api.post('/set', response_model=Schemas.Transaction)
-def set_balance(steam_id: str, value: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def set_balance(steam_id: str, value: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     checkToken(db, token)
     user = getUser(db, steam_id)
     balance = getOrCreateBalance(db, user)
@@ -51,11 +58,12 @@ def set_balance(steam_id: str, value: int, db: Session = Depends(get_db), token:
     transaction = Models.Transaction(balance=balance, value=value, description='set')
     db.add(transaction)
     db.commit()
+    bumpVersions(r, BALANCE, [steam_id])
     db.refresh(transaction)
     return transaction
 
 @balance_api.post('/pay', response_model=Schemas.DuplexTransaction)
-def pay_balance(source_steam_id: str, target_steam_id: str, value: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def pay_balance(source_steam_id: str, target_steam_id: str, value: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     if value < 0: raise HTTPException(400, f"Value must be positive!")
     checkToken(db, token)
     source = getUser(db, source_steam_id)
@@ -68,18 +76,19 @@ def pay_balance(source_steam_id: str, target_steam_id: str, value: int, db: Sess
     transaction = Models.DuplexTransaction(source=sourceBalance, target=targetBalance, value=value, description='pay')
     db.add(transaction)
     db.commit()
+    bumpVersions(r, BALANCE, [source_steam_id, target_steam_id])
     db.refresh(transaction)
     return transaction
 
 
-@balance_api.get('/drop', response_model=Schemas.MoneyDrop)
-def drop_money(steam_id: str, db: Session = Depends(get_db)):
+@balance_api.get('/drop', response_model=Schemas.MoneyDrop, dependencies=[Depends(DROP_RATE_LIMIT)])
+def drop_money(steam_id: str, db: Session = Depends(get_db), r: SyncRedis = Depends(getSyncRedis)):
     user = getOrCreateUser(db, steam_id)
     lastDrop = db.query(Models.MoneyDrop).filter(Models.MoneyDrop.userId == user.id).order_by(Models.MoneyDrop.time.desc()).first()
     if lastDrop is not None and (lastDrop.time + DROP_COOLDOWN > datetime.datetime.now()):
         return {'nextDrop':lastDrop.time + DROP_COOLDOWN, 'value':0, 'user':{'steamId': user.steamId, 'id':user.id}}
     balance = getOrCreateBalance(db, user)
-    value = max(DROP_VALUE_MIN, int(np.random.normal(loc=DROP_VALUE_LOC, scale=DROP_VALUE_SCALE)))
+    value = max(DROP_VALUE_MIN, int(random.gauss(DROP_VALUE_LOC, DROP_VALUE_SCALE)))
     time = datetime.datetime.now()
     dropObj = Models.MoneyDrop(user=user, value=value, time=time)
     transaction = Models.Transaction(balance=balance, value=value, time=time, description='drop')
@@ -87,11 +96,12 @@ def drop_money(steam_id: str, db: Session = Depends(get_db)):
     db.add(dropObj)
     db.add(transaction)
     db.commit()
+    bumpVersions(r, BALANCE, [steam_id])
     return {'nextDrop':time + DROP_COOLDOWN, 'value':value, 'user':{'steamId': user.steamId, 'id':user.id}}
 
 
 @balance_api.post('/giveaway', response_model=Union[Schemas.Giveaway.Output, Schemas.StatusCode])
-def create_giveaway(steam_id: str, info: Schemas.Giveaway.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def create_giveaway(steam_id: str, info: Schemas.Giveaway.Input, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Создает раздачу токенов ценой баланса раздавающего.\n
     status:
@@ -112,11 +122,12 @@ def create_giveaway(steam_id: str, info: Schemas.Giveaway.Input, db: Session = D
     obj = Models.Giveaway(user=user, activeUntil=info.activeUntil, maxUseCount=info.useCount, reward=info.reward)
     db.add(obj)
     db.commit()
+    bumpVersions(r, BALANCE, [steam_id])
     db.refresh(obj)
     return obj
 
-@balance_api.get('/giveaway/checkout', response_model=Union[Schemas.Giveaway.Output, Schemas.StatusCode])
-def checkout_giveaway(giveaway_id: int, steam_id: str, db: Session = Depends(get_db)):
+@balance_api.get('/giveaway/checkout', response_model=Union[Schemas.Giveaway.Output, Schemas.StatusCode], dependencies=[Depends(GIVEAWAY_RATE_LIMIT)])
+def checkout_giveaway(giveaway_id: int, steam_id: str, db: Session = Depends(get_db), r: SyncRedis = Depends(getSyncRedis)):
     """
     Учавствует в раздаче `giveaway_id` от имени игрока `steam_id`.\n
     status:
@@ -142,11 +153,12 @@ def checkout_giveaway(giveaway_id: int, steam_id: str, db: Session = Depends(get
     balance.value += giveaway.reward
     db.add(gu)
     db.commit()
+    bumpVersions(r, BALANCE, [steam_id])
     db.refresh(giveaway)
     return giveaway
 
 @balance_api.delete('/giveaway')
-def delete_giveaway(giveaway_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def delete_giveaway(giveaway_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Удаляет раздачу и возвращает коины владельцу.
     """
@@ -155,8 +167,10 @@ def delete_giveaway(giveaway_id: int, db: Session = Depends(get_db), token: str
         raise HTTPException(404, 'Giveaway not found')
     balance = getOrCreateBalance(db, giveaway.user)
     balance.value += giveaway.reward * (giveaway.maxUseCount - giveaway.curUseCount)
+    steamId = giveaway.user.steamId
     db.delete(giveaway)
     db.commit()
+    bumpVersions(r, BALANCE, [steamId])
     return 'Deleted'
 
 @balance_api.get('/giveaway/all', response_model=list[Schemas.Giveaway.Output])
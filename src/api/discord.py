@@ -4,23 +4,29 @@ from src.types import api_models as Schemas
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import datetime
-from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken
+from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, SEARCH_RATE_LIMIT, getSyncRedis, SyncRedis
+from src.lib.user_versions import PRIVILEGE, bumpVersions
 
 discord_api = APIRouter()
 
-@discord_api.get('/search', response_model=List[Schemas.SteamDiscordLink])
+@discord_api.get('/search', response_model=List[Schemas.SteamDiscordLink], dependencies=[Depends(SEARCH_RATE_LIMIT)])
 def find_discord(query : str, db: Session = Depends(get_db)):
     return Crud.find_discord(db, query)
 
 @discord_api.post('', response_model=Schemas.SteamDiscordLink)
-def create_link(discord_id: str, steam_id: str, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def create_link(discord_id: str, steam_id: str, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Привязывает Discord к Steam, создает нового юзера если не найден
     """
     checkToken(db, token)
     user = getOrCreateUser(db, steam_id)
+    # Флаг discord в /privilege меняется и у нового, и у прежнего владельца привязки
+    previous = Crud.get_discord(db, discord_id)
+    changed = [steam_id] if previous is None else [steam_id, previous.user.steamId]
     Crud.delete_discord(db, discord_id)
-    return Crud.create_discord(db, user, discord_id)
+    link = Crud.create_discord(db, user, discord_id)
+    bumpVersions(r, PRIVILEGE, changed)
+    return link
 
 @discord_api.get('', response_model=Schemas.SteamDiscordLink)
 def get_discord(discord_id: str, db: Session = Depends(get_db)):
@@ -1,92 +1,207 @@
-from fastapi import Depends, HTTPException, APIRouter
-from src.database import crud as Crud, models as Models
+from fastapi import Depends, HTTPException, APIRouter, Request, Response, Body
+from src.database import crud as Crud, models as Models, predefined as Predefined
 from src.types import api_models as Schemas
 from sqlalchemy.orm import Session, Query
+from pydantic import TypeAdapter
 from typing import Optional, List
 from sqlalchemy import select
 import datetime
-from src.lib import steam_api as SteamAPI
-from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, getRedis
+from src.lib.steam_profiles import steamProfiles
+from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, getRedis, cachedResponse, getCached
 from redis.asyncio import Redis
-from src.database.sourcebans import getSourcebans, SbServer, AsyncSession
+from src.database.sourcebans import sb_session, SbServer
+from src.lib.server_status import serverInfoKey, buildSnapshot, etagMatches, SNAPSHOT_KEY, SNAPSHOT_ETAG_KEY, UPDATES_CHANNEL, ONLINE_KEY
+from src.api.pubsub import RedisBroadcaster, RESYNC
+from src.lib.steam_group import GROUP_INFO_KEY, GROUP_UPDATES_CHANNEL, GROUP_REFRESH_LOCK, GROUP_FRESH_TIME, GROUP_REFRESH_LOCK_TIME, GROUP_MEMBERS_KEY
+import src.settings as settings
+from fastapi.responses import StreamingResponse
 import json
 import asyncio
+import functools
 import logging
 
-from celery import Celery
-celery_app = Celery('tasks', broker='redis://localhost:6379/0')
-
 info_api = APIRouter()
 DONATER_CACHE_TIME = 86400
+HISTORY_FINE_RANGE = datetime.timedelta(days=2)
+STREAM_PING_INTERVAL = 15
+LOOKUP_BATCH_LIMIT = 500
+GROUP_WAIT_TIMEOUT = 15
+
+@functools.cache
+def celeryApp():
+    """
+    Клиент Celery только для send_task. Импортируется при первой отправке: celery и kombu не нужны воркерам API на старте
+    """
+    from celery import Celery
+    return Celery('tasks', broker=settings.CELERY_BROKER_URL)
+
+server_updates = RedisBroadcaster(UPDATES_CHANNEL)
+group_updates = RedisBroadcaster(GROUP_UPDATES_CHANNEL)
+privilegedListAdapter = TypeAdapter(list[Schemas.PrivilegedUserInfo])
 
 @info_api.get('/server/all', response_model=list[Schemas.ServerInfo])
-async def get_all_servers(redis: Redis = Depends(getRedis), sb: AsyncSession = Depends(getSourcebans)):
+async def get_all_servers(request: Request, redis: Redis = Depends(getRedis)):
     """
     Возвращает список всех серверов SB.\n
+    Отдает готовый снимок, который собирает Celery после каждого опроса серверов. Поддерживает If-None-Match.
     """
-    serversQuery = select(SbServer).where(SbServer.enabled == 1)
-    servers = [s._tuple()[0] for s in (await sb.execute(serversQuery)).all()]
-    result = []
-    for server in servers:
-        cached = await redis.get(f'server_info:{server.sid}')
-        if cached is not None: result.append(json.loads(cached))
-    return result
+    snapshot, etag = await redis.mget(SNAPSHOT_KEY, SNAPSHOT_ETAG_KEY)
+    if snapshot is None or etag is None:
+        async with sb_session() as sb:
+            serversQuery = select(SbServer.sid).where(SbServer.enabled == 1)
+            sids = (await sb.execute(serversQuery)).scalars().all()
+        snapshot, etag = buildSnapshot(await redis.mget([serverInfoKey(sid) for sid in sids]) if sids else [])
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etagMatches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot, media_type='application/json', headers=headers)
+
+@info_api.get('/server/stream')
+async def stream_servers(request: Request, redis: Redis = Depends(getRedis)):
+    """
+    Server-Sent Events с состоянием серверов.\n
+    Сначала отправляется событие `snapshot` со списком всех серверов (как в /server/all),
+    затем события `delta` только с изменившимися полями сервера (id, time + map, playersCount, players и т.д.).
+    """
+    async def events():
+        async with server_updates.subscribe() as queue:
+            yield b'event: snapshot\ndata: ' + ((await redis.get(SNAPSHOT_KEY)) or '[]').encode() + b'\n\n'
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=STREAM_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b': ping\n\n'
+                    continue
+                if message is RESYNC:
+                    yield b'event: snapshot\ndata: ' + ((await redis.get(SNAPSHOT_KEY)) or '[]').encode() + b'\n\n'
+                else:
+                    yield b'event: delta\ndata: ' + message.encode() + b'\n\n'
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@info_api.get('/server/history', response_model=list[Schemas.ServerStatsPoint])
+def get_server_history(
+    sid: int,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    resolution: int | None = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Возвращает историю онлайна сервера из агрегированной статистики.\n
+    @param resolution: Размер интервала в минутах (15 или 60). По умолчанию 15 для периодов до двух суток, иначе 60
+    """
+    end = end or datetime.datetime.now()
+    start = start or end - datetime.timedelta(days=1)
+    if start >= end: raise HTTPException(status_code=400, detail="start must be less than end")
+    if resolution is None:
+        resolution = 15 if end - start <= HISTORY_FINE_RANGE else 60
+    if resolution not in Crud.SERVER_STATS_ROLLUP_PERIODS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {Crud.SERVER_STATS_ROLLUP_PERIODS}")
+    return Crud.get_server_history(db, sid, resolution, start, end)
+
+@info_api.get('/player/online', response_model=Schemas.PlayerPresence)
+async def get_player_online(steam_id: str, redis: Redis = Depends(getRedis)):
+    """
+    На каком сервере сейчас играет игрок (по данным последнего опроса серверов). 404, если игрок не в сети
+    """
+    if (presence := await redis.hget(ONLINE_KEY, steam_id)) is None: # type: ignore
+        raise HTTPException(status_code=404, detail='Player is offline')
+    return {'steamId': steam_id, **json.loads(presence)}
+
+@info_api.post('/player/online', response_model=list[Schemas.PlayerPresence])
+async def get_players_online(steam_ids: list[str] = Body(), redis: Redis = Depends(getRedis)):
+    """
+    Пакетный вариант GET /player/online. Возвращает только игроков в сети
+    """
+    if len(steam_ids) > LOOKUP_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f'No more than {LOOKUP_BATCH_LIMIT} steam ids per request')
+    if len(steam_ids) == 0: return []
+    presence = await redis.hmget(ONLINE_KEY, steam_ids) # type: ignore
+    return [{'steamId': steamId, **json.loads(p)} for steamId, p in zip(steam_ids, presence) if p is not None]
+
+async def requestGroupRefresh(redis: Redis):
+    """
+    Запускает parse_group, если он еще не запущен (блокировка снимается задачей по завершении)
+    """
+    if await redis.set(GROUP_REFRESH_LOCK, 1, nx=True, ex=GROUP_REFRESH_LOCK_TIME):
+        celeryApp().send_task('src.celery.tasks.parse_group')
 
 @info_api.get('/group', response_model=Schemas.GroupInfo)
 async def get_group_info(redis: Redis = Depends(getRedis)):
     """
     Возвращает информацию о группе Steam.\n
+    Последние известные данные отдаются сразу, устаревшие обновляются в фоне.
+    Если данных еще нет, запрос ждет публикации от parse_group (не дольше GROUP_WAIT_TIMEOUT).
     """
-    group_info = await redis.get('group_info')
+    group_info = await redis.get(GROUP_INFO_KEY)
     if group_info is None:
-        celery_app.send_task('src.celery.tasks.parse_group')
-        await asyncio.sleep(5)
-        group_info = await redis.get('group_info')
+        async with group_updates.subscribe() as queue:
+            await requestGroupRefresh(redis)
+            # Данные могли появиться до подписки
+            if (group_info := await redis.get(GROUP_INFO_KEY)) is None:
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=GROUP_WAIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                group_info = await redis.get(GROUP_INFO_KEY)
         if group_info is None:
             raise HTTPException(status_code=404, detail="Group info not found")
-    
     data = json.loads(group_info)
-    if 'timestamp' not in data:
-        data['timestamp'] = datetime.datetime.now().timestamp()
-        await redis.set('group_info', json.dumps(data), ex=3600)
-    elif datetime.datetime.now().timestamp() - data['timestamp'] > 1800:
-        celery_app.send_task('src.celery.tasks.parse_group')
-    
+    if datetime.datetime.now().timestamp() - data.get('timestamp', 0) > GROUP_FRESH_TIME:
+        await requestGroupRefresh(redis)
     return data
 
+async def checkGroupMembers(redis: Redis, steam_ids: list[str]) -> list[dict]:
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(GROUP_MEMBERS_KEY)
+    pipe.smismember(GROUP_MEMBERS_KEY, steam_ids) # type: ignore
+    exists, members = await pipe.execute()
+    if not exists:
+        await requestGroupRefresh(redis)
+        raise HTTPException(status_code=503, detail="Group members are not loaded yet")
+    return [{'steamId': steamId, 'member': bool(m)} for steamId, m in zip(steam_ids, members)]
+
+@info_api.get('/group/member', response_model=Schemas.GroupMembership)
+async def get_group_member(steam_id: str, redis: Redis = Depends(getRedis)):
+    """
+    Состоит ли игрок в группе Steam (по списку участников, который загружает parse_group)
+    """
+    return (await checkGroupMembers(redis, [steam_id]))[0]
+
+@info_api.post('/group/member', response_model=list[Schemas.GroupMembership])
+async def get_group_members(steam_ids: list[str] = Body(), redis: Redis = Depends(getRedis)):
+    """
+    Пакетный вариант GET /group/member
+    """
+    if len(steam_ids) > LOOKUP_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f'No more than {LOOKUP_BATCH_LIMIT} steam ids per request')
+    if len(steam_ids) == 0: return []
+    return await checkGroupMembers(redis, steam_ids)
+
 
 
 
-async def createPrivilegedList(user: Models.User, result: list, redis: Redis, privIdList: list[int], isMax = True):
-    steamId = user.steamId
-    privileges = [i for i in user.privileges if i.privilegeId in privIdList]
-    if len(privileges) == 0: return
-    rkey = f'steam:{steamId}'
-    if (steamInfo:=(await redis.get(rkey))) is None:      
-        try:
-            steamInfo = await SteamAPI.GetPlayerSummaries(steamId)
-        except:
-            logging.info(f'Не удалось найти игрока')
-            return
-        await redis.set(rkey, json.dumps(steamInfo), ex=DONATER_CACHE_TIME)
-    else:
-        steamInfo = json.loads(steamInfo)
-    ff = max if isMax else min
-    privilegeStatus = ff(privileges, key=lambda x: x.privilegeId)
-    privilege = privilegeStatus.privilege
-    if privilegeStatus.activeUntil < datetime.datetime.now(): return
-    result.append(
-        {
-        'steamId':  steamId,
-        'steamInfo': steamInfo,
-        'privilege': {
-            'id': privilege.id,
-            'accessLevel': privilege.accessLevel,
-            'name': privilege.name,
-            'description': privilege.description,
-        }
-        }
-    )
+async def createPrivilegedList(users: list[tuple[str, Models.PrivilegeType]], redis: Redis) -> list[dict]:
+    profiles = await steamProfiles.getMany(redis, [steamId for steamId, _ in users])
+    result = []
+    for steamId, privilege in users:
+        if (steamInfo := profiles.get(steamId)) is None:
+            logging.info(f'Не удалось найти игрока {steamId}')
+            continue
+        result.append(
+            {
+            'steamId':  steamId,
+            'steamInfo': steamInfo,
+            'privilege': {
+                'id': privilege.id,
+                'accessLevel': privilege.accessLevel,
+                'name': privilege.name,
+                'description': privilege.description,
+            }
+            }
+        )
+    return result
+
 def isBoostyDatetime(d: datetime.datetime) -> bool:
     return d.isoformat()[:19] == Models.BoostyPrivilegeUntil.isoformat()[:19]
 
@@ -96,17 +211,14 @@ async def get_donaters(db: Session = Depends(get_db), redis: Redis = Depends(get
     Возвращает список донатеров.\n
     """
     rkey = 'info:donaters'  
-    if (cached := await redis.get(rkey)) is not None:
-        return json.loads(cached)
-    donatersQuery = select(Models.User).filter(Models.User.privileges.any())
-    donaters = db.execute(donatersQuery).scalars().all() # Чтобы избавиться от Row[Tuple[User]] -> User
-    result = [] # type: ignore
-    privIds = [6, 7, 8]
-    tasks = [createPrivilegedList(d, result, redis, privIds) for d in donaters]
-    await asyncio.gather(*tasks)
+    if (cached_data := await getCached(redis, rkey)) is not None:
+        return cachedResponse(cached_data)
+    donaters = Crud.get_privileged_users(db, Predefined.DonaterPrivileges)
+    result = await createPrivilegedList(donaters, redis)
     result.sort(key=lambda x: x['privilege']['id'], reverse=True)
-    await redis.set(rkey, json.dumps(result), ex=DONATER_CACHE_TIME)
-    return result
+    data = privilegedListAdapter.dump_json(privilegedListAdapter.validate_python(result))
+    await redis.set(rkey, data, ex=DONATER_CACHE_TIME)
+    return cachedResponse(data)
     
 @info_api.get('/team', response_model=list[Schemas.PrivilegedUserInfo])
 async def get_team(db: Session = Depends(get_db), redis: Redis = Depends(getRedis)):
@@ -114,14 +226,11 @@ async def get_team(db: Session = Depends(get_db), redis: Redis = Depends(getRedi
     Возвращает состав команды администарторов и модераторов.\n
     """
     rkey = 'info:team'
-    if (cached := await redis.get(rkey)) is not None:
-        return json.loads(cached)
-    adminsQuery = select(Models.User).filter(Models.User.privileges.any())
-    admins = db.execute(adminsQuery).scalars().all() # Чтобы избавиться от Row[Tuple[User]] -> User
-    result = [] # type: ignore
-    privIds = [1, 2, 3]
-    tasks = [createPrivilegedList(d, result, redis, privIds, False) for d in admins]
-    await asyncio.gather(*tasks)
+    if (cached_data := await getCached(redis, rkey)) is not None:
+        return cachedResponse(cached_data)
+    admins = Crud.get_privileged_users(db, Predefined.TeamPrivileges, isMax=False)
+    result = await createPrivilegedList(admins, redis)
     result.sort(key=lambda x: x['privilege']['id'], reverse=False)
-    await redis.set(rkey, json.dumps(result), ex=DONATER_CACHE_TIME)
-    return result
\ No newline at end of file
+    data = privilegedListAdapter.dump_json(privilegedListAdapter.validate_python(result))
+    await redis.set(rkey, data, ex=DONATER_CACHE_TIME)
+    return cachedResponse(data)
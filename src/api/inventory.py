@@ -1,17 +1,18 @@
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Request, Response
 from src.database import crud as Crud, models as Models
 from src.types import api_models as Schemas
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import datetime
-from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, findByID, findByIDOrAbort, findByField, findByFieldOrAbort
+from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, findByID, findByIDOrAbort, findByField, findByFieldOrAbort, SEARCH_RATE_LIMIT, getSyncRedis, SyncRedis, checkVersion
+from src.lib.user_versions import INVENTORY, bumpVersions, expireVersionAt
 from src.api.filter import L4D2ItemFilter, Pagination, UserInventoryFilter
 from fastapi_filter import FilterDepends
 
 inventory_api = APIRouter()
 
 @inventory_api.post('/add', response_model=Schemas.InventoryItem.Output)
-def add_item(steam_id: str, invitem: Schemas.InventoryItem.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def add_item(steam_id: str, invitem: Schemas.InventoryItem.Input, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Добавляет предмет в инвентарь пользователя.
     """
@@ -20,32 +21,39 @@ def add_item(steam_id: str, invitem: Schemas.InventoryItem.Input, db: Session =
     db.add(inv := Models.UserInventory(user=user, itemId=invitem.itemId, activeUntil=invitem.activeUntil))
     db.commit()
     db.refresh(inv)
+    bumpVersions(r, INVENTORY, [steam_id])
     return inv
 
 @inventory_api.get('/items', response_model=List[Schemas.InventoryItem.Output])
-def get_inventory_items(steam_id: str, db: Session = Depends(get_db)):
+def get_inventory_items(steam_id: str, request: Request, response: Response, db: Session = Depends(get_db), r: SyncRedis = Depends(getSyncRedis)):
     """
-    Возвращает список предметов в инвентаре пользователя.
+    Возвращает список активных (не истекших) предметов в инвентаре пользователя.\n
+    Истекшие предметы удаляет Celery задача sweep_expired.
     """
+    if (notModified := checkVersion(r, request, response, INVENTORY, steam_id)) is not None: return notModified
     user = getUser(db, steam_id)
-    db.query(Models.UserInventory).filter(Models.UserInventory.userId == user.id).filter(Models.UserInventory.activeUntil < datetime.datetime.now(tz=datetime.timezone.utc)).delete()
-    db.commit()
-    db.refresh(user)
-    return db.query(Models.UserInventory).filter(Models.UserInventory.userId == user.id).all()
+    items = db.query(Models.UserInventory) \
+        .filter(Models.UserInventory.userId == user.id) \
+        .filter(Models.UserInventory.activeUntil > datetime.datetime.now(tz=datetime.timezone.utc)).all()
+    expireVersionAt(r, INVENTORY, steam_id, min((i.activeUntil for i in items), default=None))
+    return items
 
 
 @inventory_api.delete('')
-def delete_inventory_item(inventory_item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def delete_inventory_item(inventory_item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Удаляет предмет из любого инвентаря.
     """
     checkToken(db, token)
-    db.delete(findByIDOrAbort(db, Models.UserInventory, inventory_item_id))
+    inv_item = findByIDOrAbort(db, Models.UserInventory, inventory_item_id)
+    steamId = inv_item.user.steamId
+    db.delete(inv_item)
     db.commit()
+    bumpVersions(r, INVENTORY, [steamId])
     return "Item deleted successfully"
 
 @inventory_api.post('/checkout', response_model=Schemas.L4D2Item.Output)
-def checkout_item(inventory_item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def checkout_item(inventory_item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Выдаёт предмет из инвентаря пользователя (при этом он считается истекшим).
     """
@@ -56,6 +64,7 @@ def checkout_item(inventory_item_id: int, db: Session = Depends(get_db), token:
     inv_item.activeUntil = datetime.datetime.now(tz=datetime.timezone.utc)
     db.commit()
     db.refresh(inv_item)
+    bumpVersions(r, INVENTORY, [inv_item.user.steamId])
     return inv_item.item
 
 
@@ -67,7 +76,7 @@ def get_inventory_item(inventory_item_id: int, db: Session = Depends(get_db)):
     return findByIDOrAbort(db, Models.UserInventory, inventory_item_id)
 
 
-@inventory_api.get('/search', response_model=List[Schemas.InventoryItem.Output])
+@inventory_api.get('/search', response_model=List[Schemas.InventoryItem.Output], dependencies=[Depends(SEARCH_RATE_LIMIT)])
 def inventory_search(
     db: Session = Depends(get_db), 
     user_inventory_filter: UserInventoryFilter = FilterDepends(UserInventoryFilter), 
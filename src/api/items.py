@@ -1,19 +1,60 @@
 from fastapi import Depends, HTTPException, APIRouter
+from contextlib import asynccontextmanager
 from src.database import crud as Crud, models as Models
 from src.types import api_models as Schemas
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import datetime
-from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, findByID, findByIDOrAbort, findByField, findByFieldOrAbort
+from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, findByID, findByIDOrAbort, findByField, findByFieldOrAbort, RateLimit, SEARCH_RATE_LIMIT, getSyncRedis, SyncRedis, catalogOrAbort
+from src.database.catalog import catalog, CATALOG_CHANNEL
+from src.api.pubsub import RedisBroadcaster, RESYNC
+from src.lib.rate_limit import SlidingWindow
 from src.api.filter import L4D2ItemFilter, Pagination, PrivilegeItemFilter
 from fastapi_filter import FilterDepends
+import asyncio
+import logging
 
 
 DROP_COOLDOWN = datetime.timedelta(hours=12)
+DROP_RATE_LIMIT = RateLimit('items_drop', steamId=SlidingWindow(5, 60), ip=SlidingWindow(600, 60))
 
 items_api = APIRouter()
+catalog_updates = RedisBroadcaster(CATALOG_CHANNEL)
 
-@items_api.get('/drop', response_model=Schemas.EmptyDrop.Output)
+async def reloadCatalog():
+    try:
+        await asyncio.to_thread(catalog.reload)
+    except Exception as e:
+        logging.warning(f'Catalog reload failed: {str(e)}')
+
+@asynccontextmanager
+async def watchCatalog():
+    """
+    Загружает каталог при запуске и, пока открыт, перечитывает его, когда справочники меняет
+    другой процесс API (или подписка на Redis прерывалась).\n
+    Загрузка идет после подписки, чтобы не пропустить изменения между ними. Если БД недоступна,
+    каталог загрузится при первом обращении.
+    """
+    loaded = asyncio.Event()
+    async def listen():
+        try:
+            async with catalog_updates.subscribe() as queue:
+                await reloadCatalog()
+                loaded.set()
+                while True:
+                    message = await queue.get()
+                    if message is not RESYNC and catalog.isOwnMessage(message): continue
+                    await reloadCatalog()
+        finally:
+            loaded.set()
+    task = asyncio.create_task(listen())
+    await loaded.wait()
+    try:
+        yield
+    finally:
+        task.cancel()
+
+@items_api.get('/drop', response_model=Schemas.EmptyDrop.Output, dependencies=[Depends(DROP_RATE_LIMIT)])
 def drop_item(steam_id: str, db: Session = Depends(get_db)):
     """
     Пустой дроп.\n
@@ -42,7 +83,7 @@ def drop_item(steam_id: str, db: Session = Depends(get_db)):
 
 
 @items_api.post('/l4d2_item', response_model=Schemas.L4D2Item.Output)
-def create_l4d2_item(item: Schemas.L4D2Item.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def create_l4d2_item(item: Schemas.L4D2Item.Input, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Добавляет в базу данных предмет из L4D2.\n
     Принимает название предмета и команду, которая выдаст его.
@@ -52,25 +93,26 @@ def create_l4d2_item(item: Schemas.L4D2Item.Input, db: Session = Depends(get_db)
     db.add(obj)
     db.commit()
     db.refresh(obj)
+    catalog.changed(r)
     return obj
 
 
 @items_api.get('/l4d2_item', response_model=Schemas.L4D2Item.Output)
-def get_l4d2_item(item_id: int, db: Session = Depends(get_db)):
+def get_l4d2_item(item_id: int):
     """
     Выдает предмет по id.
     """
-    return findByIDOrAbort(db, Models.L4D2Item, item_id)
+    return catalogOrAbort(catalog.snapshot.l4d2Items, Models.L4D2Item, item_id)
 
 
 @items_api.get('/l4d2_item/by_name', response_model=Schemas.L4D2Item.Output)
-def get_l4d2_item_byname(item_name: str, db: Session = Depends(get_db)):
+def get_l4d2_item_byname(item_name: str):
     """
     Выдает предмет по названию (первый подходящий).
     """
-    return findByFieldOrAbort(db, Models.L4D2Item, Models.L4D2Item.name, item_name)
+    return catalogOrAbort(catalog.snapshot.l4d2ItemsByName, Models.L4D2Item, item_name, 'name')
 
-@items_api.get('/l4d2_item/search', response_model=List[Schemas.L4D2Item.Output])
+@items_api.get('/l4d2_item/search', response_model=List[Schemas.L4D2Item.Output], dependencies=[Depends(SEARCH_RATE_LIMIT)])
 def search_l4d2_items(db: Session = Depends(get_db), items_filter: L4D2ItemFilter = FilterDepends(L4D2ItemFilter), pagination: Pagination = Depends(Pagination)):
     query = db.query(Models.L4D2Item)
     query = items_filter.filter(query)
@@ -79,17 +121,18 @@ def search_l4d2_items(db: Session = Depends(get_db), items_filter: L4D2ItemFilte
     return query.all()
 
 @items_api.delete('/l4d2_item')
-def delete_l4d2_item(item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def delete_l4d2_item(item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Удаляет предмет L4D2 из базы данных.
     """
     checkToken(db, token)
     db.delete(findByIDOrAbort(db, Models.L4D2Item, item_id))
     db.commit()
+    catalog.changed(r)
     return "Item deleted successfully"
 
 @items_api.put('/l4d2_item', response_model=Schemas.L4D2Item.Output)
-def change_l4d2_item(item_id: int, updated_item: Schemas.L4D2Item.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def change_l4d2_item(item_id: int, updated_item: Schemas.L4D2Item.Input, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Изменяет данные предмета L4D2.
     """
@@ -98,48 +141,52 @@ def change_l4d2_item(item_id: int, updated_item: Schemas.L4D2Item.Input, db: Ses
     item.name = updated_item.name
     item.command = updated_item.command
     db.commit()
+    catalog.changed(r)
     return item
 
 
 
 @items_api.post('/privilege_item', response_model=Schemas.PrivilegeItem.Output)
-def create_privilege_item(item: Schemas.PrivilegeItem.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def create_privilege_item(item: Schemas.PrivilegeItem.Input, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     """
     Создает привелеиию, как предмет, который может быть выдан пользователю.
     """
     checkToken(db, token)
-    findByIDOrAbort(db, Models.PrivilegeType, item.privilegeTypeId)
+    catalogOrAbort(catalog.snapshot.privilegeTypes, Models.PrivilegeType, item.privilegeTypeId)
     db.add(obj:=Models.PrivilegeItem(name=item.name, duration=item.duration, privilegeTypeId=item.privilegeTypeId))
     db.commit()
-    db.refresh(obj)
-    return obj
+    catalog.changed(r)
+    return catalog.snapshot.privilegeItems[obj.id]
 
 @items_api.get('/privilege_item', response_model=Schemas.PrivilegeItem.Output)
-def get_privilege_item(item_id: int, db: Session = Depends(get_db)):
-    return findByIDOrAbort(db, Models.PrivilegeItem, item_id)
+def get_privilege_item(item_id: int):
+    return catalogOrAbort(catalog.snapshot.privilegeItems, Models.PrivilegeItem, item_id)
 
 @items_api.delete('/privilege_item')
-def delete_privilege_item(item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def delete_privilege_item(item_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     checkToken(db, token)
     db.delete(findByIDOrAbort(db, Models.PrivilegeItem, item_id))
     db.commit()
+    catalog.changed(r)
     return "PrivilegeItem deleted successfully"
 
 @items_api.put('/privilege_item', response_model=Schemas.PrivilegeItem.Output)
-def change_privilege_item(item_id: int, updated_item: Schemas.PrivilegeItem.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+def change_privilege_item(item_id: int, updated_item: Schemas.PrivilegeItem.Input, db: Session = Depends(get_db), token: str = Depends(requireToken), r: SyncRedis = Depends(getSyncRedis)):
     checkToken(db, token)
     item = findByIDOrAbort(db, Models.PrivilegeItem, item_id)
+    catalogOrAbort(catalog.snapshot.privilegeTypes, Models.PrivilegeType, updated_item.privilegeTypeId)
     item.name = updated_item.name
     item.duration = updated_item.duration
     item.privilegeTypeId = updated_item.privilegeTypeId
     db.commit()
-    return item
+    catalog.changed(r)
+    return catalog.snapshot.privilegeItems[item_id]
 
 @items_api.get('/privilege_item/by_name', response_model=Schemas.PrivilegeItem.Output)
-def get_privilege_item_byname(item_name: str, db: Session = Depends(get_db)):
-    return findByFieldOrAbort(db, Models.PrivilegeItem, Models.PrivilegeItem.name, item_name)
+def get_privilege_item_byname(item_name: str):
+    return catalogOrAbort(catalog.snapshot.privilegeItemsByName, Models.PrivilegeItem, item_name, 'name')
 
-@items_api.get('/privilege_item/search', response_model=List[Schemas.PrivilegeItem.Output])
+@items_api.get('/privilege_item/search', response_model=List[Schemas.PrivilegeItem.Output], dependencies=[Depends(SEARCH_RATE_LIMIT)])
 def search_privilege_items(db: Session = Depends(get_db), items_filter: PrivilegeItemFilter = FilterDepends(PrivilegeItemFilter), pagination: Pagination = Depends(Pagination)):
     query = db.query(Models.PrivilegeItem)
     query = items_filter.filter(query)
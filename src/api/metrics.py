@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Request, Response
+from src.lib.metrics import REQUEST_LATENCY, CONTENT_TYPE, latest
+from src.database.profiler import profileQueries
+import time
+import logging
+
+metrics_api = APIRouter()
+
+@metrics_api.get('', include_in_schema=False)
+def get_metrics():
+    """
+    Метрики в формате Prometheus.
+    """
+    return Response(content=latest(), media_type=CONTENT_TYPE)
+
+async def metricsMiddleware(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Шаблон пути (/info/server/all), а не сам путь, чтобы не плодить метки
+    route = request.scope.get('route')
+    REQUEST_LATENCY.labels(request.method, getattr(route, 'path', 'unmatched'), response.status_code).observe(time.perf_counter() - start)
+    return response
+
+async def sqlProfilerMiddleware(request: Request, call_next):
+    """
+    Отладочный профилировщик SQL (включается SQL_PROFILER=1).\n
+    Добавляет заголовки X-SQL-Count, X-SQL-Time (мс) и X-SQL-N-Plus-One (количество повторяющихся запросов),
+    самые медленные и повторяющиеся запросы пишет в лог.
+    """
+    with profileQueries() as profile:
+        response = await call_next(request)
+    repeated = profile.repeated()
+    response.headers['X-SQL-Count'] = str(profile.count)
+    response.headers['X-SQL-Time'] = f'{profile.total * 1000:.2f}'
+    response.headers['X-SQL-N-Plus-One'] = str(len(repeated))
+    for statement, count in repeated.items():
+        logging.warning(f'N+1 in {request.method} {request.url.path}: {count}x {statement}')
+    for statement, duration in profile.slowest():
+        logging.debug(f'{request.method} {request.url.path}: {duration * 1000:.2f} ms {statement}')
+    return response
@@ -5,11 +5,13 @@ from src.types import api_models as Schemas
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import datetime
-from src.api.tools import getUser, requireToken, get_db, getOrCreateBalance, getRedis
-import src.lib.steam_api as SteamAPI
+from src.api.tools import getUser, requireToken, get_db, getRedis, cachedResponse, getCached
+from src.lib.steam_profiles import steamProfiles
 from fastapi_filter import FilterDepends
 from redis.asyncio import Redis
 from pydantic import TypeAdapter
+from fastapi.concurrency import run_in_threadpool
+import asyncio
 
 profile_api = APIRouter()
 
@@ -42,38 +44,45 @@ def perkSetToDict(perk_set: Models.PerkSet | None) -> dict:
     }
 
 
-@profile_api.get('/bulk', response_model=Schemas.BulkProfileInfo)
-async def get_bulk_profile_info(steam_id: str, cached: bool = True, db: Session = Depends(get_db), redis: Redis = Depends(getRedis)):
-    user = getUser(db, steam_id)
-    rkey = f'bulk_profile_info:{steam_id}'
-    if (result:=(await redis.get(rkey))) is not None and cached:
-        return json.loads(result)
-    try:   
-        steamInfo = await SteamAPI.GetPlayerSummaries(user.steamId)
-    except:
-        raise HTTPException(status_code=404, detail="Игрок не найден")
-    rank = Crud.get_player_rank(db, user)
-    perks = Crud.get_perks(db, user.id)
-    privileges = Crud.get_privilegeStatuses(db, user.id)
-    balance = getOrCreateBalance(db, user)
-    discord = Crud.get_discord_steam(db, user)
-    discordId = None
-    if discord is not None: discordId = discord.discordId
-    result = {
-        'steamInfo': steamInfo,
-        'rank': rank,
-        'perks': perkSetToDict(perks),
+def loadProfile(db: Session, steam_id: str) -> dict:
+    """
+    Собирает все данные профиля из БД за четыре запроса и ничего не пишет.
+    """
+    user = Crud.get_profile_user(db, steam_id)
+    if user is None: raise HTTPException(status_code=404, detail='User not found!')
+    return {
+        'rank': Crud.get_player_rank(db, user),
+        'perks': perkSetToDict(Crud.get_perks(db, user.id)),
         'privileges': [
             {
                 'id':i.id, 
                 'activeUntil':i.activeUntil.isoformat(), 
-                'user':{'id':i.user.id, 'steamId':i.user.steamId},
+                'user':{'id':user.id, 'steamId':user.steamId},
                 'privilege':{'id':i.privilege.id, 'name':i.privilege.name, 'accessLevel':i.privilege.accessLevel, 'description':i.privilege.description}
             }
-            for i in privileges
+            for i in user.privileges
         ],
-        'balance': balance.value,
-        'discordId': discordId
+        'balance': user.balance.value if user.balance is not None else 0,
+        'discordId': user.discordLink.discordId if user.discordLink is not None else None
     }
-    await redis.set(rkey, json.dumps(result), ex=BULK_PROFILE_CACHE_TIME)
-    return result
\ No newline at end of file
+
+
+@profile_api.get('/bulk', response_model=Schemas.BulkProfileInfo)
+async def get_bulk_profile_info(steam_id: str, cached: bool = True, db: Session = Depends(get_db), redis: Redis = Depends(getRedis)):
+    rkey = f'bulk_profile_info:{steam_id}'
+    if cached and (result:=(await getCached(redis, rkey))) is not None:
+        return cachedResponse(result)
+    # Steam API запрашивается параллельно с БД
+    steamTask = asyncio.create_task(steamProfiles.get(redis, steam_id))
+    try:
+        profile = await run_in_threadpool(loadProfile, db, steam_id)
+    except:
+        steamTask.cancel()
+        raise
+    try:   
+        profile['steamInfo'] = await steamTask
+    except:
+        raise HTTPException(status_code=404, detail="Игрок не найден")
+    data = Schemas.BulkProfileInfo.model_validate(profile).model_dump_json()
+    await redis.set(rkey, data, ex=BULK_PROFILE_CACHE_TIME)
+    return cachedResponse(data)
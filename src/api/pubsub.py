@@ -0,0 +1,73 @@
+from src.api.tools import getRedis
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import asyncio
+import logging
+
+# Маркер, который получает подписчик, если не успевал читать и пропустил сообщения
+RESYNC = object()
+# Сколько subscribe() ждет подтверждения подписки от Redis, прежде чем отдать очередь с RESYNC
+SUBSCRIBE_TIMEOUT = 5
+
+class RedisBroadcaster:
+    """
+    Одна подписка на канал Redis на процесс, сообщения раздаются всем локальным подписчикам.\n
+    Подписка открывается с первым подписчиком и закрывается с последним.\n
+    subscribe() возвращает очередь только после того, как Redis подтвердил подписку:
+    все сообщения, опубликованные после входа в subscribe(), попадут в очередь.
+    """
+    def __init__(self, channel: str, queueSize: int = 64):
+        self.channel = channel
+        self.queueSize = queueSize
+        self.queues: set[asyncio.Queue] = set()
+        self.task: asyncio.Task | None = None
+        self.ready: asyncio.Event | None = None
+
+    async def __listen(self, ready: asyncio.Event):
+        while True:
+            try:
+                async with getRedis().pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        # SUBSCRIBE отправлен раньше, но активна подписка только после ответа Redis
+                        if message['type'] == 'subscribe': ready.set()
+                        if message['type'] != 'message': continue
+                        self.__publish(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Redis subscription to {self.channel} failed: {str(e)}')
+                ready.clear()
+                for queue in self.queues: self.__put(queue, RESYNC)
+                await asyncio.sleep(1)
+
+    def __put(self, queue: asyncio.Queue, data):
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            while not queue.empty(): queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+    def __publish(self, data):
+        for queue in self.queues: self.__put(queue, data)
+
+    @asynccontextmanager
+    async def subscribe(self) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queueSize)
+        self.queues.add(queue)
+        if self.task is None or self.task.done() or self.ready is None:
+            self.ready = asyncio.Event()
+            self.task = asyncio.create_task(self.__listen(self.ready))
+        try:
+            try:
+                await asyncio.wait_for(self.ready.wait(), SUBSCRIBE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Redis недоступен - подписчик сам перечитает данные, когда подписка восстановится
+                self.__put(queue, RESYNC)
+            yield queue
+        finally:
+            self.queues.discard(queue)
+            if len(self.queues) == 0 and self.task is not None:
+                self.task.cancel()
+                self.task = None
+                self.ready = None
@@ -0,0 +1,107 @@
+from fastapi import Depends, HTTPException, APIRouter
+from src.database import crud as Crud, models as Models
+from src.types import api_models as Schemas
+from sqlalchemy.orm import Session
+from typing import List
+from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, findByIDOrAbort, getRedis, getSyncRedis, SyncRedis
+from src.lib.quests import QUEST_PROGRESS_KEY, QUEST_FLUSH_KEY, DAILY_QUEST_COUNT, progressField, questPeriodEnd
+from redis.asyncio import Redis
+from collections import Counter
+import datetime
+
+PROGRESS_BATCH_LIMIT = 1000
+
+quests_api = APIRouter()
+
+@quests_api.get('', response_model=List[Schemas.DailyQuest.Output])
+def get_daily_quests(steam_id: str, db: Session = Depends(get_db), r: SyncRedis = Depends(getSyncRedis)):
+    """
+    Активные ежедневные задания игрока. Если заданий на текущий день еще нет (игрок не был активен
+    при смене дня), они выдаются сразу.\n
+    К curProgress прибавляется прогресс, который еще не перенесен из Redis в БД.
+    """
+    user = getOrCreateUser(db, steam_id)
+    now = datetime.datetime.now()
+    quests = Crud.get_daily_quests(db, user.id, now)
+    if len(quests) == 0 and Crud.assign_daily_quests(db, [user.id], questPeriodEnd(now), DAILY_QUEST_COUNT) > 0:
+        db.commit()
+        quests = Crud.get_daily_quests(db, user.id, now)
+    if len(quests) == 0: return []
+    fields = [progressField(steam_id, q.questId, q.activeUntil) for q in quests]
+    pipe = r.pipeline(transaction=False)
+    pipe.hmget(QUEST_PROGRESS_KEY, fields)
+    pipe.hmget(QUEST_FLUSH_KEY, fields)
+    pending, flushing = pipe.execute()
+    result = []
+    for quest, a, b in zip(quests, pending, flushing):
+        output = Schemas.DailyQuest.Output.model_validate(quest, from_attributes=True)
+        if quest.completedAt is None:
+            output.curProgress = min(quest.maxProgress, quest.curProgress + int(a or 0) + int(b or 0))
+        result.append(output)
+    return result
+
+@quests_api.post('/progress', response_model=Schemas.StatusCode)
+async def add_quest_progress(
+    progress: List[Schemas.QuestProgress],
+    redis: Redis = Depends(getRedis),
+    db: Session = Depends(get_db),
+    token: str = Depends(requireToken)):
+    """
+    Прибавляет прогресс заданий пачкой (до 1000 записей). Прогресс копится в Redis и переносится в БД
+    Celery задачей flush_quest_progress, там же завершаются задания и выдаются награды.\n
+    Прогресс для несуществующих или неактивных заданий при переносе отбрасывается.
+    """
+    checkToken(db, token)
+    if len(progress) > PROGRESS_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Too many entries, limit is {PROGRESS_BATCH_LIMIT}")
+    period = questPeriodEnd(datetime.datetime.now())
+    amounts: Counter[str] = Counter()
+    for p in progress:
+        if p.amount <= 0: raise HTTPException(status_code=400, detail="amount must be positive")
+        amounts[progressField(p.steamId, p.questId, period)] += p.amount
+    async with redis.pipeline(transaction=False) as pipe:
+        for field, amount in amounts.items():
+            pipe.hincrby(QUEST_PROGRESS_KEY, field, amount)
+        await pipe.execute()
+    return Schemas.StatusCode()
+
+
+@quests_api.post('/reward', response_model=Schemas.Reward.Output)
+def create_reward(reward: Schemas.Reward.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+    """
+    Создает награду: предмет L4D2 и/или привилегию (PrivilegeItem).
+    """
+    checkToken(db, token)
+    if reward.itemId is not None: findByIDOrAbort(db, Models.L4D2Item, reward.itemId)
+    if reward.privilegeItemId is not None: findByIDOrAbort(db, Models.PrivilegeItem, reward.privilegeItemId)
+    db.add(obj := Models.Reward(name=reward.name, itemId=reward.itemId, privilegeItemId=reward.privilegeItemId))
+    db.commit()
+    db.refresh(obj)
+    return obj
+
+@quests_api.post('/simple', response_model=Schemas.SimpleQuest.Output)
+def create_simple_quest(quest: Schemas.SimpleQuest.Input, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+    """
+    Добавляет задание в пул, из которого выбираются ежедневные задания.
+    """
+    checkToken(db, token)
+    if quest.maxProgress <= 0: raise HTTPException(status_code=400, detail="maxProgress must be positive")
+    findByIDOrAbort(db, Models.Reward, quest.rewardId)
+    db.add(obj := Models.SimpleQuest(name=quest.name, description=quest.description, rewardId=quest.rewardId, maxProgress=quest.maxProgress))
+    db.commit()
+    db.refresh(obj)
+    return obj
+
+@quests_api.get('/simple/all', response_model=List[Schemas.SimpleQuest.Output])
+def get_simple_quests(db: Session = Depends(get_db)):
+    return db.query(Models.SimpleQuest).order_by(Models.SimpleQuest.id).all()
+
+@quests_api.delete('/simple')
+def delete_simple_quest(quest_id: int, db: Session = Depends(get_db), token: str = Depends(requireToken)):
+    """
+    Удаляет задание из пула вместе с выданными по нему ежедневными заданиями.
+    """
+    checkToken(db, token)
+    db.delete(findByIDOrAbort(db, Models.SimpleQuest, quest_id))
+    db.commit()
+    return "Quest deleted successfully"
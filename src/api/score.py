@@ -5,23 +5,23 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from typing import List
 import datetime
-from src.api.tools import requireToken, get_db, getOrCreateUser, checkToken, getRedis, getUser
+from src.api.tools import requireToken, get_db, getOrCreateUser, checkToken, getRedis, getUser, cachedResponse, getCached, SEARCH_RATE_LIMIT
 from src.api.filter import SeasonFilter, RoundScoreFilter, Pagination
 from typing import TypeVar
 from sqlalchemy import func, select
 from fastapi_filter import FilterDepends
 from redis.asyncio import Redis # type: ignore
-import src.lib.steam_api as SteamAPI
+from src.lib.steam_profiles import steamProfiles
 from sqlalchemy.sql.expression import cast
 import src.database.crud as Crud
 from sqlalchemy import Integer
-import json
-import asyncio
+import orjson
 
 
 
-PROFILE_CACHE_TIME = 86400
 TOP_CACHE_TIME = 3600
+# Если часть профилей Steam не загрузилась (429, таймаут), топ кэшируется ненадолго
+TOP_PARTIAL_CACHE_TIME = 60
 
 score_api = APIRouter()
 
@@ -51,7 +51,7 @@ def add_round_score(steam_id: str, score: Schemas.RoundScore.Input, db: Session
 def get_round_score(score_id: int, db: Session = Depends(get_db)):
     return getObj(score_id, db, Models.RoundScore)
 
-@score_api.get('/round/search', response_model=List[Schemas.RoundScore.Output])
+@score_api.get('/round/search', response_model=List[Schemas.RoundScore.Output], dependencies=[Depends(SEARCH_RATE_LIMIT)])
 def search_round_scores(score_filter: RoundScoreFilter = FilterDepends(RoundScoreFilter), db: Session = Depends(get_db)):
     query = db.query(Models.RoundScore).join(Models.User)
     query = score_filter.filter(query)
@@ -84,7 +84,7 @@ def initiate_season(date: datetime.date | None = None, db: Session = Depends(get
     db.commit()
     return {'message': 'done!'}
 
-@score_api.get('/season/search', response_model=List[Schemas.ScoreSeason.Output])
+@score_api.get('/season/search', response_model=List[Schemas.ScoreSeason.Output], dependencies=[Depends(SEARCH_RATE_LIMIT)])
 def search_seasons(season_filter: SeasonFilter = FilterDepends(SeasonFilter), db: Session = Depends(get_db)):
     query = db.query(Models.ScoreSeason).join(Models.User)
     query = season_filter.filter(query)
@@ -100,26 +100,6 @@ def search_seasons(season_filter: SeasonFilter = FilterDepends(SeasonFilter), db
 # group by steamId 
 # order by score desc;
 
-async def createTopList(item: tuple[int, str, int], result: list, redis: Redis):
-    steamId = item[1]
-    rkey = f'steam:{steamId}'
-    if (steamInfo:=(await redis.get(rkey))) is None:      
-        steamInfo = await SteamAPI.GetPlayerSummaries(steamId)
-        await redis.set(rkey, json.dumps(steamInfo), ex=PROFILE_CACHE_TIME)
-    else:
-        steamInfo = json.loads(steamInfo)
-    result.append(
-        {
-        'rank':     item[0],
-        'steamId':  steamId,
-        'score':    item[2],
-        'steamInfo': steamInfo
-        }
-    )
-
-"""
-TODO: Steam API per player, cache redis per player (ex: 3days)
-"""
 @score_api.get('/top', response_model=None)
 async def get_top_scores(
     pagination: Pagination = Depends(Pagination), 
@@ -129,8 +109,8 @@ async def get_top_scores(
     if pagination.limit > 100:
         raise HTTPException(status_code=400, detail="Limit must be less than or equal to 100.")
     rkey = f'top:{pagination.limit}:{pagination.offset}'
-    if (data:=(await redis.get(rkey))) is not None:
-        return json.loads(data)
+    if (data:=(await getCached(redis, rkey))) is not None:
+        return cachedResponse(data)
     top = select(
         func.dense_rank().over(order_by=func.sum(Models.RoundScore.agression + Models.RoundScore.support + Models.RoundScore.perks).desc()),
         Models.User.steamId,
@@ -139,13 +119,20 @@ async def get_top_scores(
     .group_by(Models.User.steamId) \
     .order_by(func.sum(Models.RoundScore.agression + Models.RoundScore.support +Models.RoundScore.perks).desc())
     query = pagination.paginate(top)
-    queryResult = db.execute(query)
-    result : list[dict] = []
-    tasks = [createTopList(i, result, redis) for i in queryResult]
-    await asyncio.gather(*tasks)
-    result = sorted(result, key=lambda x: x['rank'])
-    await redis.set(rkey, json.dumps(result), ex=TOP_CACHE_TIME)
-    return result
+    rows = db.execute(query).all()
+    profiles, failed = await steamProfiles.resolve(redis, [row[1] for row in rows])
+    result = [
+        {
+        'rank':     rank,
+        'steamId':  steamId,
+        'score':    score,
+        'steamInfo': profiles.get(steamId)
+        }
+        for rank, steamId, score in rows
+    ]
+    data = orjson.dumps(result)
+    await redis.set(rkey, data, ex=TOP_CACHE_TIME if len(failed) == 0 else TOP_PARTIAL_CACHE_TIME)
+    return cachedResponse(data)
 
 
 
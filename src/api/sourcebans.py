@@ -4,10 +4,11 @@ from src.types import api_models as Schemas
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import datetime
-from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken
+from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, getRedis
 from src.database.sourcebans import getSourcebans, AsyncSession
 from src.lib.rcon_api import banPlayer, BanExistsError
-from src.lib.steam_api import GetPlayerSummaries
+from src.lib.steam_profiles import steamProfiles
+from redis.asyncio import Redis
 
 sb_api = APIRouter()
 
@@ -16,7 +17,8 @@ async def ban(
     steam_id: str, reason: str, duration: int,
     token: str = Depends(requireToken), 
     sb: AsyncSession = Depends(getSourcebans),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    redis: Redis = Depends(getRedis)
 ):
     """
     Банит игрока на серверах SB.\n
@@ -28,7 +30,7 @@ async def ban(
         raise HTTPException(status_code=400, detail="Длительность бана должна быть не менее 60 секунд")
     checkToken(db, token)
     try:
-        player = await GetPlayerSummaries(steam_id)
+        player = await steamProfiles.get(redis, steam_id)
     except:
         raise HTTPException(status_code=404, detail="Игрок не найден")
     try:
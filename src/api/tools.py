@@ -1,13 +1,18 @@
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import InstrumentedAttribute
-from src.database.models import SessionLocal
+from src.database.models import SessionLocal, get_db
 from src.database import crud as Crud, models as Models
 from sqlalchemy.orm import Session, Query
 from typing import Optional, TypeVar, Any
 import redis.asyncio as aioredis # type: ignore
-from src.settings import REDIS_CONNECT_STRING, REDIS_DATABASE
+from src.lib.redis_client import redis_pool, getRedis, SyncRedis, getSyncRedis
 from contextlib import asynccontextmanager
+from src.lib.metrics import recordCache, RATE_LIMITED
+from src.lib.rate_limit import SlidingWindow, hitWindows
+from src.lib.user_versions import getVersion
+import logging
+import math
 
 security = HTTPBearer()
 
@@ -20,14 +25,6 @@ def requireToken(auth : Optional[HTTPAuthorizationCredentials] = Depends(securit
     if auth is None: raise HTTPException(status_code=401, detail="Bearer token not found!")
     return auth.credentials
 
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def getOrCreateUser(db: Session, steam_id:str) -> Models.User:
     user = Crud.get_user(db, steam_id)
     if not user:
@@ -46,6 +43,7 @@ def findByIDOrAbort(db: Session, model: type[T], id: int) -> T:
     return obj
 
 T2 = TypeVar('T2', bound=Models.Base)
+T3 = TypeVar('T3')
 def findByField(db:Session, model: type[T2], field: InstrumentedAttribute, value: str) -> T2 | None:
     return db.query(model).filter(field == value).first()
 
@@ -54,12 +52,70 @@ def findByFieldOrAbort(db: Session, model: type[T2], field: InstrumentedAttribut
     return obj
 
 
+def catalogOrAbort(index: dict[Any, T3], model: type[Models.Base], value: Any, field: str = 'id') -> T3:
+    """
+    findByIDOrAbort/findByFieldOrAbort для справочников из src.database.catalog (без запроса к БД)
+    """
+    if (obj := index.get(value)) is None:
+        detail = f'({value})' if field == 'id' else f'with {field}={value}'
+        raise HTTPException(404, f'Object of type <{model.__tablename__}> {detail} not found')
+    return obj
+
 
-def createRedisPool():
-    return aioredis.ConnectionPool.from_url(REDIS_CONNECT_STRING, encoding='utf-8', decode_responses=True, db=REDIS_DATABASE)
-redis_pool = createRedisPool()
-def getRedis():
-    return aioredis.Redis(connection_pool=redis_pool)
+def checkVersion(r: SyncRedis, request: Request, response: Response, resource: str, steam_id: str) -> Response | None:
+    """
+    Ставит ETag по версии ресурса игрока (src.lib.user_versions).\n
+    Если клиент прислал этот же ETag в If-None-Match, возвращает ответ 304 - обработчик отдает его без запросов к БД.
+    """
+    etag = f'"{resource}-{getVersion(r, resource, steam_id)}"'
+    response.headers['ETag'] = etag
+    if etag in [tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return Response(status_code=304, headers={'ETag': etag})
+    return None
+
+async def getCached(redis: aioredis.Redis, key: str) -> str | None:
+    """
+    redis.get для кэша с учетом попаданий/промахов в метриках (по семейству ключа: `top:`, `steam:` и т.д.)
+    """
+    value = await redis.get(key)
+    recordCache(key, value is not None)
+    return value
+
+class RateLimit:
+    """
+    Зависимость для `dependencies=[Depends(RateLimit(...))]` в декораторе пути: такие зависимости выполняются
+    раньше get_db, поэтому отклоненный запрос не открывает сессию БД.\n
+    Окна считаются отдельно для steam_id (из query) и для IP клиента, превышение любого - 429 с Retry-After.
+    """
+    def __init__(self, name: str, steamId: SlidingWindow | None = None, ip: SlidingWindow | None = None):
+        self.name = name
+        self.scopes = [(scope, window) for scope, window in (('steam_id', steamId), ('ip', ip)) if window is not None]
+
+    async def __call__(self, request: Request, redis: aioredis.Redis = Depends(getRedis)):
+        windows = []
+        for scope, window in self.scopes:
+            value = request.query_params.get('steam_id') if scope == 'steam_id' else getattr(request.client, 'host', None)
+            if value is None: continue
+            windows.append((scope, (f'ratelimit:{self.name}:{scope}:{value}', window)))
+        if len(windows) == 0: return
+        try:
+            index, retryAfter = await hitWindows(redis, [w for _, w in windows])
+        except Exception as e:
+            # Без Redis лимит не проверить - запросы пропускаются, чтобы не останавливать API
+            logging.warning(f'Rate limit {self.name} is unavailable: {str(e)}')
+            return
+        if index == 0: return
+        RATE_LIMITED.labels(self.name, windows[index - 1][0]).inc()
+        raise HTTPException(status_code=429, detail="Too many requests", headers={'Retry-After': str(max(1, math.ceil(retryAfter)))})
+
+# Общий лимит поисковых запросов: у них нет steam_id, поэтому только по IP
+SEARCH_RATE_LIMIT = RateLimit('search', ip=SlidingWindow(300, 60))
+
+def cachedResponse(data: str | bytes) -> Response:
+    """
+    Отдает уже закодированный JSON (из кэша) как есть, без json.loads и повторной сериализации.
+    """
+    return Response(content=data, media_type='application/json')
 
 
 @asynccontextmanager
@@ -2,19 +2,98 @@ from fastapi import Depends, HTTPException, APIRouter
 from src.database import crud as Crud, models as Models
 from src.types import api_models as Schemas
 from sqlalchemy.orm import Session, Query
-from typing import Optional, List
+from typing import Optional, List, Literal
 from sqlalchemy import select
 import datetime
 from src.api.tools import getUser, requireToken, get_db, getOrCreateUser, checkToken, getRedis
 from redis.asyncio import Redis
+from redis.exceptions import ResponseError
 from src.database.sourcebans import getSourcebans, SbServer, AsyncSession
+from src.api.pubsub import RedisBroadcaster, RESYNC
+import asyncio
 import json
 
 DEFAULT_EXPIRE = 86400
 PREIFX = 'values_api'
+BATCH_LIMIT = 500
+# В канал публикуется '<тип>:<ключ>' после каждой записи, значение подписчики читают сами
+UPDATES_CHANNEL = f'{PREIFX}:updates'
+WATCH_TIMEOUT = 30
+WATCH_MAX_TIMEOUT = 60
+
+value_updates = RedisBroadcaster(UPDATES_CHANNEL)
+
+# Атомарное изменение числа с ограничением результата в [min, max].
+# TTL существующего ключа сохраняется (как у INCRBY), новый ключ создается с ARGV[4]
+INCR_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+local value = 0
+if current then
+    value = tonumber(current)
+    if value == nil or value ~= math.floor(value) then
+        return redis.error_reply('value is not an integer')
+    end
+end
+value = value + tonumber(ARGV[1])
+if ARGV[2] ~= '' then value = math.max(value, tonumber(ARGV[2])) end
+if ARGV[3] ~= '' then value = math.min(value, tonumber(ARGV[3])) end
+if current then
+    redis.call('SET', KEYS[1], string.format('%d', value), 'KEEPTTL')
+else
+    redis.call('SET', KEYS[1], string.format('%d', value), 'EX', ARGV[4])
+end
+return value
+"""
+
+# Записывает ARGV[3], только если текущее значение равно ARGV[2] (или ключа нет при ARGV[1] == '0').
+# Возвращает {1, новое значение} или {0, текущее значение}
+CAS_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if (ARGV[1] == '1' and current == ARGV[2]) or (ARGV[1] == '0' and not current) then
+    redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[4])
+    return {1, ARGV[3]}
+end
+return {0, current}
+"""
 
 values_api = APIRouter()
 
+def checkBatch(keys):
+    if len(keys) > BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Too many keys, limit is {BATCH_LIMIT}")
+
+async def writeValues(redis: Redis, kind: str, values: dict, expire: int):
+    async with redis.pipeline(transaction=True) as pipe:
+        for key, value in values.items():
+            pipe.set(f'{PREIFX}:{kind}:{key}', value, ex=expire)
+            pipe.publish(UPDATES_CHANNEL, f'{kind}:{key}')
+        await pipe.execute()
+
+async def deleteValue(redis: Redis, kind: str, key: str):
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.delete(f'{PREIFX}:{kind}:{key}')
+        pipe.publish(UPDATES_CHANNEL, f'{kind}:{key}')
+        await pipe.execute()
+
+async def incrValue(redis: Redis, key: str, amount: int, min: int | None, max: int | None, expire: int) -> int:
+    if min is not None and max is not None and min > max:
+        raise HTTPException(status_code=400, detail="min is greater than max")
+    rkey = f'{PREIFX}:int:{key}'
+    try:
+        value = int(await redis.eval(INCR_SCRIPT, 1, rkey, amount, '' if min is None else min, '' if max is None else max, expire)) # type: ignore
+    except ResponseError:
+        raise HTTPException(status_code=409, detail="Value is not an integer")
+    await redis.publish(UPDATES_CHANNEL, f'int:{key}')
+    return value
+
+async def compareAndSet(redis: Redis, kind: str, key: str, expected: str | None, value: str, expire: int) -> tuple[bool, str | None]:
+    rkey = f'{PREIFX}:{kind}:{key}'
+    success, current = await redis.eval(CAS_SCRIPT, 1, rkey, '0' if expected is None else '1', expected or '', value, expire) # type: ignore
+    if success == 1:
+        await redis.publish(UPDATES_CHANNEL, f'{kind}:{key}')
+    return success == 1, current
+
+
 @values_api.post('/int', response_model=int)
 async def set_int(
     key: str, value: int, expire: int = DEFAULT_EXPIRE,
@@ -22,8 +101,7 @@ async def set_int(
     db: Session = Depends(get_db),
     token: str = Depends(requireToken)):
     checkToken(db, token)
-    rkey = f'{PREIFX}:int:{key}'
-    await redis.set(rkey, value, ex=expire)
+    await writeValues(redis, 'int', {key: value}, expire)
     return value
 
 @values_api.get('/int', response_model=int)
@@ -36,10 +114,67 @@ async def get_int(key: str, redis: Redis = Depends(getRedis)):
 
 @values_api.delete('/int')
 async def delete_int(key: str, redis: Redis = Depends(getRedis)):
-    rkey = f'{PREIFX}:int:{key}'
-    await redis.delete(rkey)
+    await deleteValue(redis, 'int', key)
     return "deleted"
 
+@values_api.post('/int/incr', response_model=int)
+async def incr_int(
+    key: str, amount: int = 1, min: int | None = None, max: int | None = None, expire: int = DEFAULT_EXPIRE,
+    redis: Redis = Depends(getRedis),
+    db: Session = Depends(get_db),
+    token: str = Depends(requireToken)):
+    """
+    Атомарно прибавляет amount и возвращает новое значение. Результат ограничивается min/max, если они заданы
+    """
+    checkToken(db, token)
+    return await incrValue(redis, key, amount, min, max, expire)
+
+@values_api.post('/int/decr', response_model=int)
+async def decr_int(
+    key: str, amount: int = 1, min: int | None = None, max: int | None = None, expire: int = DEFAULT_EXPIRE,
+    redis: Redis = Depends(getRedis),
+    db: Session = Depends(get_db),
+    token: str = Depends(requireToken)):
+    """
+    Атомарно вычитает amount и возвращает новое значение. Результат ограничивается min/max, если они заданы
+    """
+    checkToken(db, token)
+    return await incrValue(redis, key, -amount, min, max, expire)
+
+@values_api.post('/int/cas', response_model=Schemas.ValueCompareAndSet)
+async def cas_int(
+    key: str, value: int, expected: int | None = None, expire: int = DEFAULT_EXPIRE,
+    redis: Redis = Depends(getRedis),
+    db: Session = Depends(get_db),
+    token: str = Depends(requireToken)):
+    """
+    Записывает value, только если текущее значение равно expected. Без expected - только если ключа нет
+    """
+    checkToken(db, token)
+    success, current = await compareAndSet(redis, 'int', key, None if expected is None else str(expected), str(value), expire)
+    try:
+        return Schemas.ValueCompareAndSet(success=success, value=None if current is None else int(current))
+    except ValueError:
+        raise HTTPException(status_code=409, detail="Value is not an integer")
+
+@values_api.post('/int/mget', response_model=dict[str, int | None])
+async def mget_int(keys: list[str], redis: Redis = Depends(getRedis)):
+    checkBatch(keys)
+    if len(keys) == 0: return {}
+    values = await redis.mget([f'{PREIFX}:int:{key}' for key in keys])
+    return {key: None if value is None else int(value) for key, value in zip(keys, values)}
+
+@values_api.post('/int/mset', response_model=dict[str, int])
+async def mset_int(
+    values: dict[str, int], expire: int = DEFAULT_EXPIRE,
+    redis: Redis = Depends(getRedis),
+    db: Session = Depends(get_db),
+    token: str = Depends(requireToken)):
+    checkToken(db, token)
+    checkBatch(values)
+    await writeValues(redis, 'int', values, expire)
+    return values
+
 
 @values_api.post('/string', response_model=str)
 async def set_string(
@@ -48,8 +183,7 @@ async def set_string(
     db: Session = Depends(get_db),
     token: str = Depends(requireToken)):
     checkToken(db, token)
-    rkey = f'{PREIFX}:string:{key}'
-    await redis.set(rkey, value, ex=expire)
+    await writeValues(redis, 'string', {key: value}, expire)
     return value
 
 @values_api.get('/string', response_model=str)
@@ -62,6 +196,66 @@ async def get_string(key: str, redis: Redis = Depends(getRedis)):
 
 @values_api.delete('/string')
 async def delete_string(key: str, redis: Redis = Depends(getRedis)):
-    rkey = f'{PREIFX}:string:{key}'
-    await redis.delete(rkey)
-    return "deleted"
\ No newline at end of file
+    await deleteValue(redis, 'string', key)
+    return "deleted"
+
+@values_api.post('/string/cas', response_model=Schemas.ValueCompareAndSet)
+async def cas_string(
+    key: str, value: str, expected: str | None = None, expire: int = DEFAULT_EXPIRE,
+    redis: Redis = Depends(getRedis),
+    db: Session = Depends(get_db),
+    token: str = Depends(requireToken)):
+    """
+    Записывает value, только если текущее значение равно expected. Без expected - только если ключа нет
+    """
+    checkToken(db, token)
+    success, current = await compareAndSet(redis, 'string', key, expected, value, expire)
+    return Schemas.ValueCompareAndSet(success=success, value=current)
+
+@values_api.post('/string/mget', response_model=dict[str, str | None])
+async def mget_string(keys: list[str], redis: Redis = Depends(getRedis)):
+    checkBatch(keys)
+    if len(keys) == 0: return {}
+    values = await redis.mget([f'{PREIFX}:string:{key}' for key in keys])
+    return dict(zip(keys, values))
+
+@values_api.post('/string/mset', response_model=dict[str, str])
+async def mset_string(
+    values: dict[str, str], expire: int = DEFAULT_EXPIRE,
+    redis: Redis = Depends(getRedis),
+    db: Session = Depends(get_db),
+    token: str = Depends(requireToken)):
+    checkToken(db, token)
+    checkBatch(values)
+    await writeValues(redis, 'string', values, expire)
+    return values
+
+
+@values_api.get('/watch', response_model=Schemas.ValueWatch)
+async def watch_value(
+    key: str, type: Literal['int', 'string'] = 'int', since: str | None = None, timeout: float = WATCH_TIMEOUT,
+    redis: Redis = Depends(getRedis)):
+    """
+    Long-poll: отвечает, как только значение ключа станет отличаться от since
+    (без since - от значения на момент запроса), или через timeout секунд с changed=false.\n
+    Истечение ключа по TTL не публикуется и замечается только по таймауту.
+    """
+    timeout = max(0, min(timeout, WATCH_MAX_TIMEOUT))
+    rkey = f'{PREIFX}:{type}:{key}'
+    async with value_updates.subscribe() as queue:
+        value = await redis.get(rkey)
+        known = value if since is None else since
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while value == known:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                break
+            # После RESYNC сообщения могли потеряться - значение перечитывается в любом случае
+            if message is RESYNC or message == f'{type}:{key}':
+                value = await redis.get(rkey)
+    changed = value != known
+    if type == 'int' and value is not None:
+        value = int(value)
+    return Schemas.ValueWatch(key=key, value=value, changed=changed)
@@ -0,0 +1,65 @@
+"""
+Разовая подготовка базы данных перед запуском API и Celery: создание БД, миграции Alembic и начальные данные.
+
+Запуск: python -m src.bootstrap [--skip-migrations]
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy_utils import database_exists, create_database # type: ignore
+from alembic.config import Config
+from alembic import command
+from src.database.models import engine
+import src.database.predefined as Predefined
+import argparse
+import logging
+import os
+import time
+
+ALEMBIC_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alembic.ini')
+
+def createDatabase(attempts: int = 30, delay: float = 2):
+    """
+    Создает базу данных, если ее нет. Ждет, пока MySQL начнет принимать подключения
+    """
+    for attempt in range(attempts):
+        try:
+            if not database_exists(engine.url): create_database(engine.url)
+            return
+        except Exception as e:
+            if attempt == attempts - 1: raise
+            logging.warning(f'Database is not ready ({str(e)}), retrying in {delay} s')
+            time.sleep(delay)
+
+def migrate():
+    config = Config(ALEMBIC_CONFIG)
+    config.set_main_option('script_location', os.path.join(os.path.dirname(ALEMBIC_CONFIG), 'src', 'migrations'))
+    command.upgrade(config, 'head')
+
+def createData():
+    """
+    Начальные данные (src.database.predefined): служебные пользователи, типы привилегий и токен сервера
+    """
+    with Session(engine) as session:
+        for i in Predefined.Users.values():
+            session.merge(i)
+        for i in Predefined.PrivilegeTypes.values():
+            session.merge(i)
+        for i in Predefined.Privileges.values():
+            session.merge(i)
+        for i in Predefined.AuthTokens.values():
+            session.merge(i)
+        session.commit()
+
+def bootstrap(migrations: bool = True):
+    createDatabase()
+    if migrations: migrate()
+    createData()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--skip-migrations', action='store_true')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    bootstrap(not args.skip_migrations)
+    logging.info(f'Bootstrap finished in {time.perf_counter() - start:.1f} s')
@@ -1,37 +1,128 @@
 from celery import Celery # type: ignore
-from celery.signals import worker_ready #type: ignore
+from celery.schedules import crontab # type: ignore
+from celery.signals import worker_ready, worker_init, worker_process_shutdown #type: ignore
 import src.settings as settings
 from sqlalchemy import select
-from src.api.tools import get_db
 from src.database.sourcebans import getSourcebansSync, SbServer
-from src.database.models import ServerStats
-from src.lib.rcon_api import getRconPlayers
-from src.lib.source_query import getServerInfo, getServerPlayers
+from src.database.models import ServerStats, ServerStatsRollup, SessionLocal, UserInventory, DailyQuest, get_db
+import src.database.predefined as Predefined
+import src.database.crud as Crud
+from src.lib.rcon_api import rconCommandAsync, parsePlayers
+from src.lib.source_query import A2SEngine
+from src.lib.metrics import SERVER_POLL_DURATION, SERVER_POLL_ERRORS, startMetricsServer, clearMultiprocDir, markProcessDead
+from src.lib.server_status import serverInfoKey, rosterKey, buildSnapshot, serverDelta, diffRoster, presenceEntries, SNAPSHOT_KEY, SNAPSHOT_ETAG_KEY, UPDATES_CHANNEL, SESSIONS_CHANNEL, ONLINE_KEY
+from src.lib.user_versions import BALANCE, INVENTORY, PRIVILEGE, bumpVersions
+from src.lib.quests import QUEST_PROGRESS_KEY, QUEST_FLUSH_KEY, QUEST_FLUSH_LOCK, QUEST_FLUSH_LOCK_TIME, QUEST_FLUSH_INTERVAL, QUEST_EXPIRY_GRACE, DAILY_QUEST_COUNT, ACTIVE_PLAYER_TIME, REWARD_ITEM_TIME, parseProgressField, questPeriodEnd
+from src.lib.steam_group import GROUP_URL, GROUP_INFO_KEY, GROUP_INFO_TTL, GROUP_UPDATES_CHANNEL, GROUP_REFRESH_LOCK, GROUP_MEMBERS_KEY, GROUP_MAX_PAGES, parseMembersPage
+import asyncio
 import datetime
+import time
 import redis
 import logging
 import json
-import xml.etree.ElementTree as ET
 import httpx
 
 celery = Celery(__name__)
 celery.conf.broker_url = settings.CELERY_BROKER_URL
 celery.conf.result_backend = settings.CELERY_RESULT_BACKEND
+# crontab по локальному времени - как datetime.now(), по которому считаются дни заданий (questPeriodEnd)
+celery.conf.enable_utc = False
 
 redis_pool = redis.ConnectionPool.from_url(settings.REDIS_CONNECT_STRING, db=1)
 
+EXPIRY_SWEEP_INTERVAL = 300.0
+
+SERVER_STATS_RETENTION = {
+    None: datetime.timedelta(days=7),   # сырые данные (раз в минуту)
+    15: datetime.timedelta(days=90),
+    60: datetime.timedelta(days=730),
+}
+
 @celery.on_after_configure.connect
 def setup_periodic_tasks(sender: Celery, **kwargs):
     sender.add_periodic_task(60.0, fetch_server_info.s(), name='fetch_servers')
     sender.add_periodic_task(1800.0, parse_group.s(), name='parse_group')
+    sender.add_periodic_task(900.0, rollup_server_stats.s(), name='rollup_server_stats')
+    sender.add_periodic_task(3600.0, prune_server_stats.s(), name='prune_server_stats')
+    sender.add_periodic_task(EXPIRY_SWEEP_INTERVAL, sweep_expired.s(), name='sweep_expired')
+    sender.add_periodic_task(crontab(hour=0, minute=0), assign_daily_quests.s(), name='assign_daily_quests')
+    sender.add_periodic_task(QUEST_FLUSH_INTERVAL, flush_quest_progress.s(), name='flush_quest_progress')
+
+@worker_init.connect
+def clear_metrics(**kwargs):
+    clearMultiprocDir()
+
+@worker_process_shutdown.connect
+def mark_metrics_dead(pid, **kwargs):
+    markProcessDead(pid)
 
 @worker_ready.connect
 def at_start(sender, **kwargs):
+    if settings.CELERY_METRICS_PORT is not None:
+        startMetricsServer(settings.CELERY_METRICS_PORT)
     with sender.app.connection() as conn:
         sender.app.send_task('src.celery.tasks.parse_group', connection=conn)
+        # Задания на текущий день выдаются повторно без дублей - это покрывает пропущенную смену дня
+        sender.app.send_task('src.celery.tasks.assign_daily_quests', connection=conn)
+
+
+
 
+RCON_TIMEOUT = 5.0
 
+async def poll_server(engine: A2SEngine, server: SbServer) -> tuple[dict, bool] | None:
+    """
+    Опрашивает сервер (A2S + RCON). Возвращает None, если сервер недоступен.\n
+    (server_info, rosterComplete) - rosterComplete=False, если список игроков получить не удалось
+    """
+    players = []
+    pollStart = time.perf_counter()
+    serverInfo, a2sPlayers = await asyncio.gather(engine.info(server), engine.players(server), return_exceptions=True)
+    if isinstance(a2sPlayers, BaseException):
+        SERVER_POLL_ERRORS.labels(server.sid, 'a2s_players').inc()
+        a2sPlayers = []
+    if isinstance(serverInfo, BaseException):
+        logging.info("Failed to get server info")
+        SERVER_POLL_ERRORS.labels(server.sid, 'a2s_info').inc()
+        return None
+    try:
+        status = await asyncio.wait_for(rconCommandAsync(server, 'status'), RCON_TIMEOUT)
+        # A2S не отдает Steam ID, поэтому время в игре сопоставляется по нику
+        durations = {p.name: p.duration for p in a2sPlayers}
+        for p in parsePlayers(status):
+            players.append({
+                'id': p.id,
+                'ip': p.ip,
+                'name': p.name,
+                'time': durations.get(p.name, 0),
+                'steamId': p.steam64id
+            })
+        rosterComplete = True
+    except Exception as e:
+        logging.info("Failed to get players")
+        SERVER_POLL_ERRORS.labels(server.sid, 'rcon').inc()
+        rosterComplete = False
+    SERVER_POLL_DURATION.labels(server.sid).observe(time.perf_counter() - pollStart)
+    return ({
+        'id': server.sid,
+        'name': serverInfo.server_name,
+        'map': serverInfo.map_name,
+        'playersCount': serverInfo.player_count,
+        'maxPlayersCount': serverInfo.max_players,
+        'ip': server.ip,
+        'port': server.port,
+        'ping': serverInfo.ping,
+        'time': datetime.datetime.now().isoformat(),
+        'keywords': serverInfo.keywords,
+        'players': players
+    }, rosterComplete)
 
+async def poll_servers(servers: list[SbServer]) -> list[tuple[dict, bool] | None]:
+    """
+    Все серверы опрашиваются одновременно: A2S через один UDP сокет, RCON - параллельными соединениями
+    """
+    async with A2SEngine() as engine:
+        return await asyncio.gather(*(poll_server(engine, s) for s in servers))
 
 @celery.task
 def fetch_server_info():
@@ -41,81 +132,210 @@ def fetch_server_info():
     
     serversQuery = select(SbServer).where(SbServer.enabled == 1)
     servers = [s._tuple()[0] for s in sb.execute(serversQuery).all()]
-    for server in servers:
-        players = []
-        a2sPlayers = getServerPlayers(server)
-        try:
-            serverInfo = getServerInfo(server)
-        except:
-            logging.info("Failed to get server info")
-            continue
-        try:
-            for p in getRconPlayers(server):
-                try:
-                    tt = next(p2 for p2 in a2sPlayers if p2.name == p.name).duration
-                except Exception as e:
-                    logging.info(f"Failed to get player duration: {str(e)}")
-                    tt = 0
-                players.append({
-                    'id': p.id,
-                    'ip': p.ip,
-                    'name': p.name,
-                    'time': tt,
-                    'steamId': p.steam64id
-                })
-        except Exception as e:
-            logging.info("Failed to get players")
-        finalServer = {
-            'id': server.sid,
-            'name': serverInfo.server_name,
-            'map': serverInfo.map_name,
-            'playersCount': serverInfo.player_count,
-            'maxPlayersCount': serverInfo.max_players,
-            'ip': server.ip,
-            'port': server.port,
-            'ping': serverInfo.ping,
-            'time': datetime.datetime.now().isoformat(),
-            'keywords': serverInfo.keywords,
-            'players': players
-        }
+    if len(servers) == 0: return
+    results = asyncio.run(poll_servers(servers))
+    now = datetime.datetime.now()
+    with redis.Redis(connection_pool=redis_pool) as r:
+        rosters = r.mget([rosterKey(s.sid) for s in servers])
+    sessions = []
+    deltas = []
+    online: dict[str, str] = {}
+    for server, result, roster in zip(servers, results, rosters):
+        if result is None: continue
+        finalServer, rosterComplete = result
         with redis.Redis(connection_pool=redis_pool) as r:
-            r.set(f'server_info:{server.sid}', json.dumps(finalServer), ex=86400)
+            previous = r.set(serverInfoKey(server.sid), json.dumps(finalServer), ex=86400, get=True)
+            pipe = r.pipeline()
+            if (delta := serverDelta(json.loads(previous) if previous else None, finalServer)) is not None:
+                deltas.append(json.dumps(delta))
+            # Без списка игроков (RCON не ответил) нельзя отличить выход игроков от ошибки - состав не меняется
+            if rosterComplete:
+                previousRoster = json.loads(roster) if roster else None
+                newRoster, joined, left = diffRoster(previousRoster, finalServer['players'], now)
+                pipe.set(rosterKey(server.sid), json.dumps(newRoster), ex=86400)
+                online.update(presenceEntries(server.sid, newRoster))
+                # В первом опросе (нет прошлого состава) все игроки "заходят" - событий об этом не нужно
+                events = ([{'type': 'join', 'sid': server.sid, **p} for p in joined] if previousRoster is not None else []) \
+                    + [{'type': 'leave', 'sid': server.sid, **p} for p in left]
+                for event in events: pipe.publish(SESSIONS_CHANNEL, json.dumps(event))
+                sessions += [
+                    (p['steamId'], datetime.datetime.fromisoformat(p['joinedAt']), datetime.datetime.fromisoformat(p['leftAt']))
+                    for p in left
+                ]
+            elif roster:
+                online.update(presenceEntries(server.sid, json.loads(roster)))
+            pipe.execute()
         serverObj = ServerStats(
-            players=serverInfo.player_count,
-            maxPlayers=serverInfo.max_players,
-            map=serverInfo.map_name,
-            name=serverInfo.server_name,
-            ping=serverInfo.ping,
+            players=finalServer['playersCount'],
+            maxPlayers=finalServer['maxPlayersCount'],
+            map=finalServer['map'],
+            name=finalServer['name'],
+            ping=finalServer['ping'],
             ip=server.ip,
             port=server.port,
             sid=server.sid
         )
         db.add(serverObj)
+    Crud.add_play_sessions(db, sessions)
     db.commit()
+    # Общий снимок для /info/server/all. Недоступные в этом цикле серверы берутся из прошлых данных
+    with redis.Redis(connection_pool=redis_pool) as r:
+        snapshot, etag = buildSnapshot(r.mget([serverInfoKey(s.sid) for s in servers]))
+        pipe = r.pipeline()
+        pipe.set(SNAPSHOT_KEY, snapshot, ex=86400)
+        pipe.set(SNAPSHOT_ETAG_KEY, etag, ex=86400)
+        # Дельты публикуются в одной транзакции со снимком: клиент, подключившийся во время опроса,
+        # получает либо старый снимок и все дельты цикла, либо уже новый снимок
+        for delta in deltas: pipe.publish(UPDATES_CHANNEL, delta)
+        # Индекс игроков онлайн собирается заново и подменяется атомарно (RENAME), читатели не видят половину индекса
+        if len(online) > 0:
+            pipe.delete(ONLINE_KEY + ':tmp')
+            pipe.hset(ONLINE_KEY + ':tmp', mapping=online)
+            pipe.expire(ONLINE_KEY + ':tmp', 600)
+            pipe.rename(ONLINE_KEY + ':tmp', ONLINE_KEY)
+        else:
+            pipe.delete(ONLINE_KEY)
+        pipe.execute()
     logging.info('Servers fetched')
 
 
+@celery.task
+def rollup_server_stats():
+    logging.info('Rolling up server stats')
+    with SessionLocal() as db:
+        for period in Crud.SERVER_STATS_ROLLUP_PERIODS:
+            created = Crud.rollup_server_stats(db, period)
+            logging.info(f'Created {created} rollups ({period} min)')
+
+
+@celery.task
+def prune_server_stats():
+    logging.info('Pruning server stats')
+    now = datetime.datetime.now()
+    with SessionLocal() as db:
+        for period, retention in SERVER_STATS_RETENTION.items():
+            if period is None:
+                deleted = Crud.prune_server_stats(db, ServerStats, now - retention)
+            else:
+                deleted = Crud.prune_server_stats(db, ServerStatsRollup, now - retention, period)
+            logging.info(f'Deleted {deleted} server stats ({period or "raw"})')
+
+
 
 @celery.task
 def parse_group():
+    """
+    Информация о группе Steam и список участников (все страницы memberslistxml) в Redis множестве GROUP_MEMBERS_KEY.\n
+    Участники пишутся во временное множество, которое заменяет старое только после загрузки всех страниц.
+    """
     logging.info('Parsing group info')
-    group_href = 'https://steamcommunity.com/groups/vortexl4d4'
-    href = f'{group_href}/memberslistxml/?xml=1'
+    membersTmp = GROUP_MEMBERS_KEY + ':tmp'
+    try:
+        with httpx.Client(timeout=30) as client, redis.Redis(connection_pool=redis_pool) as r:
+            r.delete(membersTmp)
+            url: str | None = f'{GROUP_URL}/memberslistxml/?xml=1'
+            details: dict[str, str] = {}
+            page = 0
+            while url is not None and page < GROUP_MAX_PAGES:
+                with client.stream('GET', url) as response:
+                    response.raise_for_status()
+                    fields = parseMembersPage(response.iter_bytes(), lambda ids: r.sadd(membersTmp, *ids))
+                details = details or fields
+                url = fields.get('nextPageLink')
+                page += 1
+
+            info = json.dumps({
+                'membersCount': int(details['memberCount']),
+                'membersInGame': int(details['membersInGame']),
+                'membersOnline': int(details['membersOnline']),
+                'timestamp': datetime.datetime.now().timestamp()
+            })
+            pipe = r.pipeline()
+            # Неполный список (страниц больше GROUP_MAX_PAGES) не заменяет старый: участники с
+            # незагруженных страниц считались бы не состоящими в группе
+            if url is not None:
+                logging.warning(f'Group members list has more than {GROUP_MAX_PAGES} pages, members are not updated')
+            elif r.exists(membersTmp):
+                pipe.expire(membersTmp, GROUP_INFO_TTL)
+                pipe.rename(membersTmp, GROUP_MEMBERS_KEY)
+            pipe.set(GROUP_INFO_KEY, info, ex=GROUP_INFO_TTL)
+            pipe.publish(GROUP_UPDATES_CHANNEL, info)
+            pipe.execute()
+    finally:
+        with redis.Redis(connection_pool=redis_pool) as r:
+            r.delete(GROUP_REFRESH_LOCK, membersTmp)
+    logging.info(f'Group info parsed ({page} pages)')
+
+
+@celery.task
+def sweep_expired():
+    """
+    Удаляет истекшие предметы инвентаря и ежедневные задания, возвращает коины за истекшие раздачи
+    и сбрасывает кэш списков донатеров/команды, если у кого-то закончилась привилегия.\n
+    Версии (ETag) инвентаря и баланса затронутых игроков сбрасываются.\n
+    Перед удалением заданий переносится накопленный прогресс (он может относиться к заданиям прошлого дня),
+    а сами задания удаляются спустя QUEST_EXPIRY_GRACE - на случай, если перенос сейчас не удался.
+    """
+    logging.info('Sweeping expired objects')
+    try:
+        flush_quest_progress()
+    except Exception as e:
+        logging.warning(f'Quest progress flush failed: {str(e)}')
+    now = datetime.datetime.now()
+    with SessionLocal() as db, redis.Redis(connection_pool=redis_pool) as r:
+        items = Crud.delete_expired(db, UserInventory, now)
+        quests = Crud.delete_expired(db, DailyQuest, now - QUEST_EXPIRY_GRACE)
+        refunds = Crud.refund_expired_giveaways(db, now)
+        bumpVersions(r, INVENTORY, Crud.get_steam_ids(db, items))
+        bumpVersions(r, BALANCE, Crud.get_steam_ids(db, refunds))
+        last = r.get('expiry:last_sweep')
+        since = datetime.datetime.fromtimestamp(float(last)) if last else now - datetime.timedelta(seconds=EXPIRY_SWEEP_INTERVAL)
+        expired = Crud.get_expired_privilege_ids(db, since, now)
+        if expired & set(Predefined.DonaterPrivileges): r.delete('info:donaters')
+        if expired & set(Predefined.TeamPrivileges): r.delete('info:team')
+        r.set('expiry:last_sweep', now.timestamp())
+    logging.info(f'Expired: inventory of {len(items)} users, quests of {len(quests)} users, {len(refunds)} giveaway refunds')
 
-    response = httpx.get(href)
-    data = response.text
 
-    root = ET.fromstring(data)
-    root = root.find('groupDetails')
+@celery.task
+def assign_daily_quests():
+    """
+    Выдает ежедневные задания всем игрокам, которые играли за последние ACTIVE_PLAYER_TIME.\n
+    Остальные получают задания при первом запросе GET /quests.
+    """
+    logging.info('Assigning daily quests')
+    now = datetime.datetime.now()
+    with SessionLocal() as db:
+        players = Crud.get_active_players(db, now - ACTIVE_PLAYER_TIME)
+        assigned = Crud.assign_daily_quests(db, players, questPeriodEnd(now), DAILY_QUEST_COUNT)
+        db.commit()
+    logging.info(f'Assigned {assigned} quests to {len(players)} active players')
 
-    membersCount = int(root.find('memberCount').text)
-    membersInGame = int(root.find('membersInGame').text)
-    membersOnline = int(root.find('membersOnline').text)
 
+@celery.task
+def flush_quest_progress():
+    """
+    Переносит прогресс заданий, накопленный в Redis (POST /quests/progress), в БД одной транзакцией.\n
+    Хэш прогресса переименовывается в QUEST_FLUSH_KEY, новые запросы пишут уже в пустой хэш.
+    Снимок удаляется только после commit: если перенос не удался, он будет повторен в следующий раз.
+    """
     with redis.Redis(connection_pool=redis_pool) as r:
-        r.set('group_info', json.dumps({
-            'membersCount': membersCount,
-            'membersInGame': membersInGame,
-            'membersOnline': membersOnline
-        }), ex=3600)
-    logging.info('Group info parsed')
\ No newline at end of file
+        if not r.set(QUEST_FLUSH_LOCK, 1, nx=True, ex=QUEST_FLUSH_LOCK_TIME): return
+        try:
+            if not r.exists(QUEST_FLUSH_KEY):
+                try:
+                    r.rename(QUEST_PROGRESS_KEY, QUEST_FLUSH_KEY)
+                except redis.ResponseError:
+                    return # прогресса нет
+            progress = {parseProgressField(field.decode()): int(amount) for field, amount in r.hgetall(QUEST_FLUSH_KEY).items()}
+            now = datetime.datetime.now()
+            with SessionLocal() as db:
+                completed = Crud.apply_quest_progress(db, progress, now, REWARD_ITEM_TIME)
+                db.commit()
+            r.delete(QUEST_FLUSH_KEY)
+            bumpVersions(r, INVENTORY, completed)
+            bumpVersions(r, PRIVILEGE, completed)
+        finally:
+            r.delete(QUEST_FLUSH_LOCK)
+    logging.info(f'Flushed progress of {len(progress)} quests, {len(completed)} players completed quests')
+
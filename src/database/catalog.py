@@ -0,0 +1,86 @@
+from sqlalchemy.orm import Session
+from src.database.models import SessionLocal
+from dataclasses import dataclass
+from redis import Redis
+import src.database.models as Models
+import src.types.api_models as Schemas
+import threading
+import uuid
+
+# После изменения справочников сюда публикуется '<origin>:<версия>', чтобы остальные процессы API перечитали каталог
+CATALOG_CHANNEL = 'catalog:updates'
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок справочников. Индексы по имени указывают на запись с меньшим id (как .first() в запросах)
+    """
+    version: int
+    privilegeTypes: dict[int, Schemas.PrivilegeType]
+    privilegeTypesByName: dict[str, Schemas.PrivilegeType]
+    l4d2Items: dict[int, Schemas.L4D2Item.Output]
+    l4d2ItemsByName: dict[str, Schemas.L4D2Item.Output]
+    privilegeItems: dict[int, Schemas.PrivilegeItem.Output]
+    privilegeItemsByName: dict[str, Schemas.PrivilegeItem.Output]
+
+def byName(objects: dict) -> dict:
+    index = {}
+    for obj in objects.values(): index.setdefault(obj.name, obj)
+    return index
+
+def loadSnapshot(db: Session, version: int) -> CatalogSnapshot:
+    types = {
+        t.id: Schemas.PrivilegeType.model_validate(t, from_attributes=True)
+        for t in db.query(Models.PrivilegeType).order_by(Models.PrivilegeType.id)
+    }
+    items = {
+        i.id: Schemas.L4D2Item.Output.model_validate(i, from_attributes=True)
+        for i in db.query(Models.L4D2Item).order_by(Models.L4D2Item.id)
+    }
+    privilegeItems = {
+        i.id: Schemas.PrivilegeItem.Output(id=i.id, name=i.name, duration=i.duration, privilegeType=types[i.privilegeTypeId])
+        for i in db.query(Models.PrivilegeItem).order_by(Models.PrivilegeItem.id)
+    }
+    return CatalogSnapshot(version, types, byName(types), items, byName(items), privilegeItems, byName(privilegeItems))
+
+class Catalog:
+    """
+    Справочники PrivilegeType, L4D2Item и PrivilegeItem в памяти процесса.\n
+    Загружаются при первом обращении и целиком заменяются новым снимком при перезагрузке,
+    поэтому читатели всегда видят согласованную версию без запросов к БД.
+    """
+    def __init__(self):
+        self.__snapshot: CatalogSnapshot | None = None
+        self.__version = 0
+        self.__lock = threading.Lock()
+        # Версии локальные для процесса, поэтому свои сообщения узнаются по origin
+        self.origin = uuid.uuid4().hex
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        if (snapshot := self.__snapshot) is None:
+            snapshot = self.reload()
+        return snapshot
+
+    def reload(self) -> CatalogSnapshot:
+        with self.__lock:
+            with SessionLocal() as db:
+                snapshot = loadSnapshot(db, self.__version + 1)
+            self.__version = snapshot.version
+            self.__snapshot = snapshot
+        return snapshot
+
+    def changed(self, r: Redis):
+        """
+        Вызывается после commit изменений справочников: перечитывает каталог и оповещает остальные процессы
+        """
+        snapshot = self.reload()
+        r.publish(CATALOG_CHANNEL, f'{self.origin}:{snapshot.version}')
+
+    def isOwnMessage(self, message: str) -> bool:
+        """
+        Сообщение опубликовано этим процессом (каталог уже перечитан в changed())
+        """
+        return message.split(':', 1)[0] == self.origin
+
+catalog = Catalog()
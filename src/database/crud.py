@@ -1,9 +1,10 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import and_, func, select, literal, insert, distinct
 import src.database.models as Models
 import src.types.api_models as Schemas
 import src.database.predefined as Predefined
 import datetime
+import random
 from typing import List
 
 def get_user(db: Session, steam_id: str):
@@ -16,6 +17,18 @@ def create_user(db: Session, steam_id: str) -> Models.User:
     db.refresh(user)
     return user
 
+def get_profile_user(db: Session, steam_id: str) -> Models.User | None:
+    """
+    Пользователь вместе с балансом, привязкой Discord и привилегиями (с типами) за два запроса.
+    """
+    return db.query(Models.User) \
+        .options(
+            joinedload(Models.User.balance),
+            joinedload(Models.User.discordLink),
+            selectinload(Models.User.privileges).joinedload(Models.PrivilegeStatus.privilege)
+        ) \
+        .filter(Models.User.steamId == steam_id).first()
+
 def get_perks(db: Session, user_id: int) -> Models.PerkSet | None:
     return db.query(Models.PerkSet).filter(Models.PerkSet.userId == user_id).order_by(Models.PerkSet.time.desc()).first()
 
@@ -33,31 +46,38 @@ def check_token(db: Session, token: str, accessLevel:int = 0):
     found = db.query(Models.AuthToken).filter(Models.AuthToken.token == token).first()
     return found is not None
 
-def __checkPriv(db: Session, user_id: int, priv_id: int):
-    prv = db.query(Models.PrivilegeStatus)\
-        .filter(Models.PrivilegeStatus.privilegeId == priv_id, Models.PrivilegeStatus.userId == user_id)\
-        .order_by(Models.PrivilegeStatus.activeUntil.desc()).first()
-    if prv is None: return False
-    return prv.activeUntil > datetime.datetime.now()
+def __activePrivileges(db: Session, user_id: int) -> dict[int, datetime.datetime]:
+    """
+    {privilegeId: ближайшее окончание} активных привилегий пользователя
+    """
+    PS = Models.PrivilegeStatus
+    query = select(PS.privilegeId, func.min(PS.activeUntil)) \
+        .where(PS.userId == user_id, PS.activeUntil > datetime.datetime.now()) \
+        .group_by(PS.privilegeId)
+    return {privilegeId: until for privilegeId, until in db.execute(query).all()}
 
-def get_privileges(db: Session, user_id: int) -> Schemas.PrivilegesList:
+def get_privileges(db: Session, user_id: int) -> tuple[Schemas.PrivilegesList, datetime.datetime | None]:
+    """
+    Возвращает (привилегии, время окончания ближайшей из них)
+    """
+    active = __activePrivileges(db, user_id)
+    types = Predefined.PrivilegeTypes
     prv = Schemas.PrivilegesList()
-    prv.owner = __checkPriv(db, user_id, Predefined.PrivilegeTypes['owner'].id)
-    prv.admin = __checkPriv(db, user_id, Predefined.PrivilegeTypes['admin'].id)
-    prv.moderator = __checkPriv(db, user_id, Predefined.PrivilegeTypes['moderator'].id)
-    prv.soundpad = __checkPriv(db, user_id, Predefined.PrivilegeTypes['soundpad'].id)
-    prv.mediaPlayer = __checkPriv(db, user_id, Predefined.PrivilegeTypes['media_player'].id)
-    prv.vip = __checkPriv(db, user_id, Predefined.PrivilegeTypes['vip'].id)
-    prv.premium = __checkPriv(db, user_id, Predefined.PrivilegeTypes['premium'].id)
-    prv.legend = __checkPriv(db, user_id, Predefined.PrivilegeTypes['legend'].id)
+    prv.owner = types['owner'].id in active
+    prv.admin = types['admin'].id in active
+    prv.moderator = types['moderator'].id in active
+    prv.soundpad = types['soundpad'].id in active
+    prv.mediaPlayer = types['media_player'].id in active
+    prv.vip = types['vip'].id in active
+    prv.premium = types['premium'].id in active
+    prv.legend = types['legend'].id in active
     phrase = db.query(Models.WelcomePhrase).filter(Models.WelcomePhrase.userId == user_id).first()
-    wp = __checkPriv(db, user_id, Predefined.PrivilegeTypes['welcomePhrase'].id) \
-        or __checkPriv(db, user_id, Predefined.PrivilegeTypes['legend'].id)
+    wp = types['welcomePhrase'].id in active or types['legend'].id in active
     prv.welcomePhrase = phrase.phrase if wp and phrase is not None else ""
     prefix = db.query(Models.CustomPrefix).filter(Models.CustomPrefix.userId == user_id).first()
-    prv.customPrefix = prefix.prefix if __checkPriv(db, user_id, Predefined.PrivilegeTypes['customPrefix'].id) and prefix is not None else ""
+    prv.customPrefix = prefix.prefix if types['customPrefix'].id in active and prefix is not None else ""
     prv.discord = db.query(Models.SteamDiscordLink).filter(Models.SteamDiscordLink.userId == user_id).first() is not None
-    return prv
+    return prv, min(active.values(), default=None)
 
 def add_privilege(db: Session, user_id: int, priv_id: int, until: datetime.datetime) -> Models.PrivilegeStatus:
     priv = Models.PrivilegeStatus(userId=user_id, privilegeId=priv_id, activeUntil=until)
@@ -74,12 +94,29 @@ def get_privilegeTypes(db: Session) -> List[Models.PrivilegeType]:
     priv = db.query(Models.PrivilegeType).all()
     return priv
 
+def get_privileged_users(db: Session, priv_ids: List[int], isMax: bool = True) -> List[tuple[str, Models.PrivilegeType]]:
+    """
+    Возвращает (steamId, PrivilegeType) для всех пользователей с активной привилегией из `priv_ids`.\n
+    Если активных привилегий несколько, берется с наибольшим (isMax) или наименьшим id. Один запрос.
+    """
+    PS = Models.PrivilegeStatus
+    ff = func.max if isMax else func.min
+    active = select(PS.userId, ff(PS.privilegeId).label('privilegeId')) \
+        .where(PS.privilegeId.in_(priv_ids), PS.activeUntil > datetime.datetime.now()) \
+        .group_by(PS.userId).subquery()
+    query = select(Models.User.steamId, Models.PrivilegeType) \
+        .join(active, active.c.userId == Models.User.id) \
+        .join(Models.PrivilegeType, Models.PrivilegeType.id == active.c.privilegeId)
+    return [row.tuple() for row in db.execute(query)]
+
 def get_privilegeStatus(db: Session, privStatus_id: int):
     privStatus = db.query(Models.PrivilegeStatus).filter(Models.PrivilegeStatus.id == privStatus_id).first()
     return privStatus
 
 def get_privilegeStatuses(db: Session, user_id: int) -> List[Models.PrivilegeStatus]:
-    privs = db.query(Models.PrivilegeStatus).filter(Models.PrivilegeStatus.userId == user_id).all()
+    privs = db.query(Models.PrivilegeStatus) \
+        .options(joinedload(Models.PrivilegeStatus.privilege), joinedload(Models.PrivilegeStatus.user)) \
+        .filter(Models.PrivilegeStatus.userId == user_id).all()
     return privs
 
 def delete_privilegeStatus(db: Session, priv_id: int):
@@ -167,23 +204,286 @@ def get_logs(db: Session, text: str, steam_id: str, nick: str | None, server: st
     return logs
 
 
-def get_player_rank(db: Session, user: Models.User) -> tuple[int] | None:
-    subquery = select(
-        Models.RoundScore.userId, 
-        func.dense_rank().over(order_by=func.sum(Models.RoundScore.agression + Models.RoundScore.support + Models.RoundScore.perks).desc()).label('rank')
-    ).group_by(Models.RoundScore.userId).alias('tbl')
-    query = select(subquery.c.rank).where(subquery.c.userId == user.id)
-    result = db.execute(query).first()
-    if result is None: return None
-    return result.tuple()[0]
+def get_player_rank(db: Session, user: Models.User) -> int | None:
+    result = get_player_rank_score(db, user)
+    return None if result is None else result[0]
 
 def get_player_rank_score(db: Session, user: Models.User) -> tuple[int, int] | None:
-    subquery = select(
-        Models.RoundScore.userId, 
-        func.sum(Models.RoundScore.agression + Models.RoundScore.support + Models.RoundScore.perks).label('score'),
-        func.dense_rank().over(order_by=func.sum(Models.RoundScore.agression + Models.RoundScore.support + Models.RoundScore.perks).desc()).label('rank')
-    ).group_by(Models.RoundScore.userId).alias('tbl')
-    query = select(subquery.c.rank, subquery.c.score).where(subquery.c.userId == user.id)
-    result = db.execute(query).first()
-    if result is None: return None
-    return result.tuple()
\ No newline at end of file
+    """
+    (место, очки) игрока. Место как у dense_rank() в /score/top: 1 + количество различных сумм больше суммы игрока.\n
+    Суммы считаются по покрывающему индексу ix_roundScore_userId_score, без сортировки всех игроков оконной функцией.
+    """
+    RS = Models.RoundScore
+    total = func.sum(RS.agression + RS.support + RS.perks)
+    score = select(total).where(RS.userId == user.id).scalar_subquery()
+    higher = select(total.label('score')).group_by(RS.userId).having(total > score).subquery()
+    result = db.execute(select(score, select(func.count(distinct(higher.c.score))).scalar_subquery())).one()
+    if result[0] is None: return None
+    return result[1] + 1, int(result[0])
+
+SERVER_STATS_ROLLUP_PERIODS = (15, 60)
+SERVER_STATS_ROLLUP_WINDOW = datetime.timedelta(days=1)
+
+def floor_time(time: datetime.datetime, period: int) -> datetime.datetime:
+    """
+    Округляет время вниз до начала интервала в `period` минут (делитель 60).
+    """
+    return time.replace(minute=time.minute - time.minute % period, second=0, microsecond=0)
+
+def __rollupSource(db: Session, period: int, start: datetime.datetime, end: datetime.datetime):
+    """
+    Возвращает строки (sid, time, avgPlayers, peakPlayers, maxPlayers, map, samples) для агрегации.
+    15-минутные интервалы строятся по сырым данным, часовые - по 15-минутным.
+    """
+    if period == SERVER_STATS_ROLLUP_PERIODS[0]:
+        SS = Models.ServerStats
+        query = select(SS.sid, SS.time, SS.players, SS.players, SS.maxPlayers, SS.map, literal(1)) \
+            .where(SS.time >= start, SS.time < end)
+    else:
+        SR = Models.ServerStatsRollup
+        query = select(SR.sid, SR.time, SR.avgPlayers, SR.peakPlayers, SR.maxPlayers, SR.map, SR.samples) \
+            .where(SR.period == SERVER_STATS_ROLLUP_PERIODS[0], SR.time >= start, SR.time < end)
+    return db.execute(query)
+
+def rollup_server_stats(db: Session, period: int, now: datetime.datetime | None = None) -> int:
+    """
+    Досчитывает все закрытые интервалы длиной `period` минут после последнего посчитанного.
+    Возвращает количество созданных записей.
+    """
+    SR = Models.ServerStatsRollup
+    end = floor_time(now or datetime.datetime.now(), period)
+    last = db.query(func.max(SR.time)).filter(SR.period == period).scalar()
+    if last is not None:
+        start = last + datetime.timedelta(minutes=period)
+    else:
+        if period == SERVER_STATS_ROLLUP_PERIODS[0]:
+            first = db.query(func.min(Models.ServerStats.time)).scalar()
+        else:
+            first = db.query(func.min(SR.time)).filter(SR.period == SERVER_STATS_ROLLUP_PERIODS[0]).scalar()
+        if first is None: return 0
+        start = floor_time(first, period)
+    created = 0
+    while start < end:
+        windowEnd = min(end, start + SERVER_STATS_ROLLUP_WINDOW)
+        buckets: dict[tuple[int, datetime.datetime], dict] = {}
+        for sid, time, avg, peak, maxPlayers, mapName, samples in __rollupSource(db, period, start, windowEnd):
+            b = buckets.setdefault((sid, floor_time(time, period)), {'sum': 0.0, 'samples': 0, 'peak': 0, 'max': 0, 'maps': {}})
+            b['sum'] += avg * samples
+            b['samples'] += samples
+            b['peak'] = max(b['peak'], peak)
+            b['max'] = max(b['max'], maxPlayers)
+            b['maps'][mapName] = b['maps'].get(mapName, 0) + samples
+        db.add_all(
+            SR(
+                sid=sid, period=period, time=time,
+                avgPlayers=b['sum'] / b['samples'],
+                peakPlayers=b['peak'],
+                maxPlayers=b['max'],
+                map=max(b['maps'], key=b['maps'].get),
+                samples=b['samples']
+            )
+            for (sid, time), b in buckets.items()
+        )
+        db.commit()
+        created += len(buckets)
+        start = windowEnd
+    return created
+
+def prune_server_stats(db: Session, model: type[Models.ServerStats] | type[Models.ServerStatsRollup], before: datetime.datetime, period: int | None = None, batch: int = 5000) -> int:
+    """
+    Удаляет записи старше `before` пачками по `batch` строк, чтобы не держать долгие блокировки.
+    """
+    deleted = 0
+    while True:
+        query = select(model.id).where(model.time < before)
+        if period is not None: query = query.where(Models.ServerStatsRollup.period == period)
+        ids = db.execute(query.limit(batch)).scalars().all()
+        if len(ids) == 0: break
+        db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+    return deleted
+
+def get_server_history(db: Session, sid: int, period: int, start: datetime.datetime, end: datetime.datetime) -> List[Models.ServerStatsRollup]:
+    SR = Models.ServerStatsRollup
+    return db.query(SR) \
+        .filter(SR.sid == sid, SR.period == period, SR.time >= start, SR.time < end) \
+        .order_by(SR.time).all()
+
+
+def delete_expired(db: Session, model: type[Models.UserInventory] | type[Models.DailyQuest], now: datetime.datetime, batch: int = 1000) -> list[int]:
+    """
+    Удаляет истекшие записи пачками по индексу activeUntil.\n
+    Возвращает id пользователей, у которых что-то было удалено.
+    """
+    users: set[int] = set()
+    while True:
+        rows = db.execute(select(model.id, model.userId).where(model.activeUntil < now).limit(batch)).all()
+        if len(rows) == 0: break
+        db.query(model).filter(model.id.in_([r[0] for r in rows])).delete(synchronize_session=False)
+        db.commit()
+        users.update(r[1] for r in rows)
+    return list(users)
+
+def refund_expired_giveaways(db: Session, now: datetime.datetime, batch: int = 500) -> list[int]:
+    """
+    Возвращает создателям неизрасходованные коины истекших раздач и удаляет раздачи (как DELETE /balance/giveaway).\n
+    Возвращает id пользователей, которым был сделан возврат.
+    """
+    users: set[int] = set()
+    while True:
+        giveaways = db.query(Models.Giveaway) \
+            .filter(Models.Giveaway.activeUntil < now) \
+            .order_by(Models.Giveaway.id).limit(batch).with_for_update().all()
+        if len(giveaways) == 0: break
+        userIds = {g.userId for g in giveaways}
+        balances = {b.userId: b for b in db.query(Models.Balance).filter(Models.Balance.userId.in_(userIds)).with_for_update()}
+        for g in giveaways:
+            refund = g.reward * max(0, g.maxUseCount - g.curUseCount)
+            if refund == 0: continue
+            if (balance := balances.get(g.userId)) is None:
+                db.add(balance := Models.Balance(userId=g.userId, value=0))
+                balances[g.userId] = balance
+            balance.value += refund
+            users.add(g.userId)
+        db.query(Models.Giveaway).filter(Models.Giveaway.id.in_([g.id for g in giveaways])).delete(synchronize_session=False)
+        db.commit()
+    return list(users)
+
+def get_expired_privilege_ids(db: Session, since: datetime.datetime, now: datetime.datetime) -> set[int]:
+    """
+    Типы привилегий, которые истекли в промежутке (since, now].
+    """
+    PS = Models.PrivilegeStatus
+    query = select(PS.privilegeId).where(PS.activeUntil > since, PS.activeUntil <= now).distinct()
+    return set(db.execute(query).scalars().all())
+
+
+def get_steam_ids(db: Session, user_ids: list[int]) -> list[str]:
+    if len(user_ids) == 0: return []
+    return list(db.execute(select(Models.User.steamId).where(Models.User.id.in_(user_ids))).scalars().all())
+
+def get_or_create_users(db: Session, steam_ids: list[str]) -> dict[str, int]:
+    """
+    {steamId: userId}. Недостающие пользователи создаются (без commit)
+    """
+    if len(steam_ids) == 0: return {}
+    users = dict(db.execute(select(Models.User.steamId, Models.User.id).where(Models.User.steamId.in_(steam_ids))).tuples().all())
+    missing = [Models.User(steamId=s) for s in set(steam_ids) if s not in users]
+    if len(missing) > 0:
+        db.add_all(missing)
+        db.flush()
+        users.update({u.steamId: u.id for u in missing})
+    return users
+
+def add_play_sessions(db: Session, sessions: list[tuple[str, datetime.datetime, datetime.datetime]]) -> int:
+    """
+    Пакетная запись сессий (steamId, timeFrom, timeTo) одним INSERT (без commit)
+    """
+    if len(sessions) == 0: return 0
+    users = get_or_create_users(db, [s[0] for s in sessions])
+    db.execute(insert(Models.PlaySession), [
+        {'userId': users[steamId], 'timeFrom': timeFrom, 'timeTo': timeTo}
+        for steamId, timeFrom, timeTo in sessions
+    ])
+    return len(sessions)
+
+
+def get_active_players(db: Session, since: datetime.datetime) -> list[int]:
+    """
+    id пользователей, у которых была игровая сессия после `since`
+    """
+    query = select(Models.PlaySession.userId).where(Models.PlaySession.timeTo >= since).distinct()
+    return list(db.execute(query).scalars().all())
+
+def assign_daily_quests(db: Session, user_ids: list[int], until: datetime.datetime, count: int) -> int:
+    """
+    Выдает по `count` случайных заданий на период до `until` тем пользователям, у которых их еще нет.\n
+    Задания и их награды вставляются двумя пакетными запросами независимо от количества игроков (без commit).\n
+    Строки пользователей блокируются до конца транзакции, поэтому параллельные вызовы (GET /quests,
+    задача Celery) для одного игрока выполняются по очереди и не выдают задания дважды.
+    Возвращает количество выданных заданий.
+    """
+    DQ = Models.DailyQuest
+    if len(user_ids) == 0: return 0
+    quests = db.execute(select(Models.SimpleQuest.id, Models.SimpleQuest.maxProgress)).tuples().all()
+    if len(quests) == 0: return 0
+    # Блокировки берутся в порядке id - пакетная выдача и запросы игроков не блокируют друг друга взаимно
+    db.execute(select(Models.User.id).where(Models.User.id.in_(user_ids)).order_by(Models.User.id).with_for_update()).all()
+    # Блокирующее чтение видит задания, выданные параллельной транзакцией (обычный SELECT в MySQL читает старый снимок)
+    assigned = set(db.execute(select(DQ.userId).where(DQ.activeUntil == until, DQ.userId.in_(user_ids)).with_for_update()).scalars().all())
+    rows = [
+        {'userId': userId, 'questId': questId, 'maxProgress': maxProgress, 'curProgress': 0, 'activeUntil': until}
+        for userId in set(user_ids) - assigned
+        for questId, maxProgress in random.sample(quests, min(count, len(quests)))
+    ]
+    if len(rows) == 0: return 0
+    db.execute(insert(DQ), rows)
+    # Награда задания копируется в награды выданного экземпляра (последующие правки SimpleQuest его не меняют)
+    rewards = select(DQ.id, Models.SimpleQuest.rewardId) \
+        .join(Models.SimpleQuest, Models.SimpleQuest.id == DQ.questId) \
+        .where(DQ.activeUntil == until, DQ.userId.in_(set(user_ids) - assigned))
+    db.execute(insert(Models.DailyQuests_Rewards).from_select(['dailyQuestId', 'rewardId'], rewards))
+    return len(rows)
+
+def get_daily_quests(db: Session, user_id: int, now: datetime.datetime) -> List[Models.DailyQuest]:
+    DQ = Models.DailyQuest
+    return db.query(DQ) \
+        .options(
+            joinedload(DQ.user),
+            joinedload(DQ.quest).joinedload(Models.SimpleQuest.reward).options(
+                joinedload(Models.Reward.item), joinedload(Models.Reward.privilegeItem).joinedload(Models.PrivilegeItem.privilegeType)
+            ),
+            selectinload(DQ.rewards).options(
+                joinedload(Models.Reward.item), joinedload(Models.Reward.privilegeItem).joinedload(Models.PrivilegeItem.privilegeType)
+            )
+        ) \
+        .filter(DQ.userId == user_id, DQ.activeUntil > now) \
+        .order_by(DQ.id).all()
+
+def grant_rewards(db: Session, rewards: List[tuple[int, Models.Reward]], now: datetime.datetime, itemTime: datetime.timedelta):
+    """
+    Выдает награды [(userId, награда)] двумя пакетными запросами (без commit):
+    предмет - в инвентарь на `itemTime`, привилегию - на ее длительность
+    """
+    items = [
+        {'userId': userId, 'itemId': reward.itemId, 'activeUntil': now + itemTime}
+        for userId, reward in rewards if reward.itemId is not None
+    ]
+    privileges = [
+        {'userId': userId, 'privilegeId': reward.privilegeItem.privilegeTypeId, 'activeUntil': now + datetime.timedelta(seconds=reward.privilegeItem.duration)}
+        for userId, reward in rewards if reward.privilegeItem is not None
+    ]
+    if len(items) > 0: db.execute(insert(Models.UserInventory), items)
+    if len(privileges) > 0: db.execute(insert(Models.PrivilegeStatus), privileges)
+
+def apply_quest_progress(db: Session, progress: dict[tuple[str, int, datetime.datetime], int], now: datetime.datetime, itemTime: datetime.timedelta) -> list[str]:
+    """
+    Прибавляет накопленный прогресс {(steamId, questId, конец периода): сумма} к незавершенным заданиям этого периода
+    (а не к активным на момент переноса - прогресс за прошлый день после полуночи не теряется).\n
+    Задания блокируются (FOR UPDATE), поэтому завершение и выдача наград происходят ровно один раз
+    и в той же транзакции (без commit). Возвращает steamId игроков, завершивших задания.
+    """
+    DQ = Models.DailyQuest
+    if len(progress) == 0: return []
+    users = dict(db.execute(select(Models.User.steamId, Models.User.id).where(Models.User.steamId.in_({s for s, _, _ in progress}))).tuples().all())
+    amounts = {(users[s], q, p): amount for (s, q, p), amount in progress.items() if s in users}
+    if len(amounts) == 0: return []
+    quests = db.query(DQ) \
+        .options(selectinload(DQ.rewards).joinedload(Models.Reward.privilegeItem)) \
+        .filter(DQ.userId.in_({u for u, _, _ in amounts}), DQ.questId.in_({q for _, q, _ in amounts})) \
+        .filter(DQ.activeUntil.in_({p for _, _, p in amounts}), DQ.completedAt.is_(None)) \
+        .with_for_update().all()
+    steamIds = {userId: steamId for steamId, userId in users.items()}
+    completed = set()
+    rewards = []
+    for quest in quests:
+        if (amount := amounts.get((quest.userId, quest.questId, quest.activeUntil.replace(tzinfo=None)))) is None: continue
+        quest.curProgress = min(quest.maxProgress, quest.curProgress + amount)
+        if quest.curProgress < quest.maxProgress: continue
+        quest.completedAt = now
+        rewards += [(quest.userId, reward) for reward in quest.rewards]
+        completed.add(steamIds[quest.userId])
+    grant_rewards(db, rewards, now, itemTime)
+    return list(completed)
+
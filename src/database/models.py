@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey, String, Integer, Float, DateTime, Text, SmallInteger, Date, Table, Column
+from sqlalchemy import ForeignKey, String, Integer, Float, DateTime, Text, SmallInteger, Date, Table, Column, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column as column, relationship, sessionmaker
 from sqlalchemy.sql import func as sqlFunc
 from typing import List, Optional
@@ -7,12 +7,23 @@ import os
 from sqlalchemy import create_engine
 from src.settings import SQL_CONNECT_STRING
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from src.lib.metrics import instrumentEngine
+from src.database.profiler import profileEngine
 
 #'2050-01-01T00:00:00'
 BoostyPrivilegeUntil = datetime.datetime(year=2050, month=1, day=1, hour=0, minute=0, second=0)
 
 engine = create_engine(SQL_CONNECT_STRING)
+instrumentEngine(engine, 'main')
+profileEngine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 # asyncEngine = create_async_engine(SQL_CONNECT_STRING)
 # AsyncSessionLocal = sessionmaker(asyncEngine, _class=AsyncSession, autoflush=False, autocommit=False) #type: ignore
 
@@ -78,7 +89,7 @@ class PrivilegeStatus(IDModel):
     privilegeId : Mapped[int] = column(ForeignKey('privilegeType.id'))
     privilege : Mapped["PrivilegeType"] = relationship(back_populates='statuses')
 
-    activeUntil : Mapped[datetime.datetime] = column(DateTime(timezone=True), default=sqlFunc.now())
+    activeUntil : Mapped[datetime.datetime] = column(DateTime(timezone=True), default=sqlFunc.now(), index=True)
 
 
 class AuthToken(IDModel):
@@ -148,6 +159,10 @@ class ChatLog(IDModel):
 
 class RoundScore(IDModel):
     __tablename__ = 'roundScore'
+    __table_args__ = (
+        # Покрывающий индекс: суммы очков по игрокам (рейтинг) считаются по индексу без чтения строк
+        Index('ix_roundScore_userId_score', 'userId', 'agression', 'support', 'perks'),
+    )
     userId : Mapped[int] = column(ForeignKey('user.id'))
     user : Mapped["User"] = relationship('User', foreign_keys='RoundScore.userId')
     agression: Mapped[int] = column(Integer, default=0)
@@ -195,7 +210,7 @@ class Giveaway(IDModel):
     userId : Mapped[int] = column(ForeignKey('user.id'))
     user : Mapped["User"] = relationship('User', foreign_keys='Giveaway.userId')
     timeCreated : Mapped[datetime.datetime] = column(DateTime(timezone=True), server_default=sqlFunc.now())
-    activeUntil : Mapped[datetime.datetime] = column(DateTime(timezone=True))
+    activeUntil : Mapped[datetime.datetime] = column(DateTime(timezone=True), index=True)
     maxUseCount: Mapped[int] = column(Integer, default=1)
     curUseCount: Mapped[int] = column(Integer, default=0)
     reward: Mapped[int] = column(Integer)
@@ -236,13 +251,19 @@ class SimpleQuest(IDModel):
     description: Mapped[str] = column(String(128), default='This is a simple quest')
     rewardId: Mapped[int] = column(ForeignKey('reward.id', ondelete='cascade'))
     reward: Mapped["Reward"] = relationship('Reward', foreign_keys='SimpleQuest.rewardId')
+    maxProgress: Mapped[int] = column(Integer, default=1, server_default='1')
     
 class DailyQuest(IDModel):
     __tablename__ = 'dailyQuest'
-    activeUntil: Mapped[datetime.datetime] = column(DateTime(timezone=True))
+    __table_args__ = (
+        Index('ix_dailyQuest_userId_questId', 'userId', 'questId'),
+    )
+    activeUntil: Mapped[datetime.datetime] = column(DateTime(timezone=True), index=True)
     curProgress: Mapped[int] = column(Integer, default=0)
     maxProgress: Mapped[int] = column(Integer, default=1)
+    completedAt: Mapped[Optional[datetime.datetime]] = column(DateTime(timezone=True), nullable=True, default=None)
     questId: Mapped[int] = column(ForeignKey('simpleQuest.id', ondelete='cascade'))
+    quest: Mapped["SimpleQuest"] = relationship('SimpleQuest', foreign_keys='DailyQuest.questId')
     userId: Mapped[int] = column(ForeignKey('user.id', ondelete='cascade'))
     user: Mapped["User"] = relationship('User', foreign_keys='DailyQuest.userId')
     rewards: Mapped[List["Reward"]] = relationship('Reward', secondary='dailyQuests_Rewards', back_populates='dailyQuests')
@@ -266,13 +287,13 @@ class UserInventory(IDModel):
     user: Mapped["User"] = relationship('User', foreign_keys='UserInventory.userId')
     itemId: Mapped[int] = column(ForeignKey('l4d2Item.id', ondelete='cascade'))
     item: Mapped["L4D2Item"] = relationship('L4D2Item', foreign_keys='UserInventory.itemId')
-    activeUntil: Mapped[datetime.datetime] = column(DateTime(timezone=True))
+    activeUntil: Mapped[datetime.datetime] = column(DateTime(timezone=True), index=True)
 
 
 
 class ServerStats(IDModel):
     __tablename__ ='serverStats'
-    time: Mapped[datetime.datetime] = column(DateTime(timezone=True), server_default=sqlFunc.now())
+    time: Mapped[datetime.datetime] = column(DateTime(timezone=True), server_default=sqlFunc.now(), index=True)
     players: Mapped[int] = column(Integer)
     maxPlayers: Mapped[int] = column(Integer)
     map: Mapped[str] = column(String(32))
@@ -281,8 +302,21 @@ class ServerStats(IDModel):
     ip: Mapped[str] = column(String(32))
     port: Mapped[int] = column(Integer)
     sid: Mapped[int] = column(Integer)
-    
-    
-    
-    
-    
\ No newline at end of file
+
+
+#
+# Агрегированная статистика серверов.
+# period - размер интервала в минутах (15 или 60), time - начало интервала
+class ServerStatsRollup(IDModel):
+    __tablename__ = 'serverStatsRollup'
+    __table_args__ = (
+        Index('ix_serverStatsRollup_sid_period_time', 'sid', 'period', 'time', unique=True),
+    )
+    sid: Mapped[int] = column(Integer)
+    period: Mapped[int] = column(SmallInteger)
+    time: Mapped[datetime.datetime] = column(DateTime(timezone=True))
+    avgPlayers: Mapped[float] = column(Float)
+    peakPlayers: Mapped[int] = column(Integer)
+    maxPlayers: Mapped[int] = column(Integer)
+    map: Mapped[str] = column(String(32))
+    samples: Mapped[int] = column(Integer)
@@ -24,6 +24,9 @@ PrivilegeTypes = {
     
 }
 
+DonaterPrivileges = [PrivilegeTypes['vip'].id, PrivilegeTypes['premium'].id, PrivilegeTypes['legend'].id]
+TeamPrivileges = [PrivilegeTypes['owner'].id, PrivilegeTypes['admin'].id, PrivilegeTypes['moderator'].id]
+
 Privileges = {
     'server': PrivilegeStatus(id=1,userId=Users['server'].id,privilegeId=PrivilegeTypes['owner'].id,activeUntil=FarTime),
     'Y4r0z_admin': PrivilegeStatus(id=2, userId=Users['Y4r0z'].id, privilegeId=PrivilegeTypes['admin'].id, activeUntil=FarTime)
@@ -0,0 +1,65 @@
+from contextvars import ContextVar
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+from sqlalchemy import event, Engine
+import time
+
+N_PLUS_ONE_THRESHOLD = 3
+
+@dataclass
+class QueryProfile:
+    """
+    SQL запросы, выполненные в рамках одного HTTP запроса (или блока profileQueries).
+    """
+    statements: list[tuple[str, float]] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def total(self) -> float:
+        return sum(t for _, t in self.statements)
+
+    def slowest(self, n: int = 3) -> list[tuple[str, float]]:
+        return sorted(self.statements, key=lambda x: x[1], reverse=True)[:n]
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> dict[str, int]:
+        """
+        Одинаковые (с точностью до параметров) запросы, выполненные `threshold` и более раз - вероятный N+1.
+        """
+        counts: dict[str, int] = {}
+        for statement, _ in self.statements:
+            counts[statement] = counts.get(statement, 0) + 1
+        return {s: c for s, c in counts.items() if c >= threshold}
+
+current_profile: ContextVar[QueryProfile | None] = ContextVar('current_profile', default=None)
+
+def profileEngine(engine: Engine):
+    """
+    Записывает запросы движка в текущий QueryProfile, если он есть.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None:
+            conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        if (profile := current_profile.get()) is not None and conn.info.get('profiler_start'):
+            profile.statements.append((statement, time.perf_counter() - conn.info['profiler_start'].pop()))
+
+@contextmanager
+def profileQueries() -> Iterator[QueryProfile]:
+    """
+    with profileQueries() as profile:
+        ...
+    assert profile.count <= 3
+    """
+    profile = QueryProfile()
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
@@ -2,17 +2,35 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sess
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from sqlalchemy import create_engine
 import src.settings as settings
+from src.lib.metrics import instrumentEngine
+from src.database.profiler import profileEngine
+import functools
 
 from sqlalchemy.sql.schema import Column, Index, Table
 from sqlalchemy.sql.sqltypes import Integer, SmallInteger, String, Text
 from sqlalchemy.schema import FetchedValue
 
 
-sb_engine = create_async_engine(settings.SOURCEBANS_CONNECT_STRING)
-sb_session = async_sessionmaker(sb_engine)
+# Движки создаются при первом обращении: API нужен только асинхронный, Celery - только синхронный
+@functools.cache
+def asyncSessionMaker() -> async_sessionmaker[AsyncSession]:
+    engine = create_async_engine(settings.SOURCEBANS_CONNECT_STRING)
+    instrumentEngine(engine.sync_engine, 'sourcebans')
+    profileEngine(engine.sync_engine)
+    return async_sessionmaker(engine)
 
-sb_engine_sync = create_engine(settings.SOURCEBANS_CONNECT_STRING.replace('aiomysql', 'pymysql'))
-sb_session_sync = sessionmaker(sb_engine_sync)
+@functools.cache
+def syncSessionMaker() -> sessionmaker:
+    engine = create_engine(settings.SOURCEBANS_CONNECT_STRING.replace('aiomysql', 'pymysql'))
+    instrumentEngine(engine, 'sourcebans')
+    profileEngine(engine)
+    return sessionmaker(engine)
+
+def sb_session() -> AsyncSession:
+    return asyncSessionMaker()()
+
+def sb_session_sync():
+    return syncSessionMaker()()
 
 async def getSourcebans():
     async with sb_session() as session:
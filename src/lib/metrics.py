@@ -0,0 +1,88 @@
+import os
+import glob
+import time
+
+# В режиме нескольких процессов (gunicorn -w N, celery prefork) метрики пишутся в файлы в этой папке.
+# Папка должна существовать до импорта prometheus_client
+if (multiprocDir := os.environ.get('PROMETHEUS_MULTIPROC_DIR')) is not None:
+    os.makedirs(multiprocDir, exist_ok=True)
+
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, start_http_server, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST as CONTENT_TYPE
+from sqlalchemy import event, Engine
+
+REQUEST_LATENCY = Histogram('api_request_duration_seconds', 'HTTP request latency by route', ['method', 'route', 'status'])
+
+SQL_QUERIES = Counter('db_queries_total', 'Executed SQL statements', ['database'])
+SQL_DURATION = Histogram(
+    'db_query_duration_seconds', 'SQL statement duration', ['database'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+)
+
+RATE_LIMITED = Counter('api_rate_limited_total', 'Requests rejected by rate limits', ['limit', 'scope'])
+
+CACHE_REQUESTS = Counter('cache_requests_total', 'Redis cache lookups by key family', ['family', 'result'])
+
+STEAM_LATENCY = Histogram('steam_api_request_duration_seconds', 'Steam Web API call latency', ['method'])
+STEAM_ERRORS = Counter('steam_api_errors_total', 'Failed Steam Web API calls', ['method', 'reason'])
+STEAM_RETRIES = Counter('steam_api_retries_total', 'Retried Steam Web API calls (429, 5xx, timeouts)', ['method'])
+
+SERVER_POLL_DURATION = Histogram(
+    'server_poll_duration_seconds', 'Time to poll one game server (A2S + RCON)', ['sid'],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+SERVER_POLL_ERRORS = Counter('server_poll_errors_total', 'Failed game server polls', ['sid', 'stage'])
+
+
+def instrumentEngine(engine: Engine, database: str):
+    """
+    Считает количество и длительность SQL запросов движка.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        SQL_QUERIES.labels(database).inc()
+        SQL_DURATION.labels(database).observe(time.perf_counter() - conn.info['metrics_start'].pop())
+
+def cacheFamily(key: str) -> str:
+    """
+    'bulk_profile_info:7656...' -> 'bulk_profile_info:'
+    """
+    return key.split(':', 1)[0] + ':'
+
+def recordCache(key: str, hit: bool):
+    CACHE_REQUESTS.labels(cacheFamily(key), 'hit' if hit else 'miss').inc()
+
+def clearMultiprocDir():
+    """
+    Удаляет файлы метрик прошлых запусков: после перезапуска контейнера (restart: always) /tmp сохраняется,
+    и файлы старых PID продолжали бы суммироваться в /metrics. Вызывается в главном процессе до запуска воркеров.
+    """
+    if multiprocDir is None: return
+    for path in glob.glob(os.path.join(multiprocDir, '*.db')):
+        os.remove(path)
+
+def markProcessDead(pid: int):
+    """
+    Убирает live-метрики завершившегося воркера (gunicorn child_exit, Celery worker_process_shutdown)
+    """
+    if multiprocDir is None: return
+    multiprocess.mark_process_dead(pid) # type: ignore
+
+def __registry() -> CollectorRegistry:
+    if multiprocDir is None: return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry) # type: ignore
+    return registry
+
+def latest() -> bytes:
+    return generate_latest(__registry())
+
+def startMetricsServer(port: int):
+    """
+    Отдельный HTTP сервер с метриками (для Celery worker, у которого нет своего API).
+    """
+    start_http_server(port, registry=__registry())
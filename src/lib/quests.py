@@ -0,0 +1,33 @@
+import datetime
+
+# Прогресс ежедневных заданий копится в Redis хэше {steamId:questId:период: сумма} и периодически переносится в БД.
+# Период (день, до конца которого действует задание) хранится в поле, чтобы прогресс, присланный перед
+# полуночью и перенесенный после нее, попал в задания своего дня
+QUEST_PROGRESS_KEY = 'quests:progress'
+# Снимок хэша, который сейчас переносится (после неудачного переноса обрабатывается повторно)
+QUEST_FLUSH_KEY = 'quests:progress:flushing'
+QUEST_FLUSH_LOCK = 'quests:flush_lock'
+QUEST_FLUSH_LOCK_TIME = 300
+QUEST_FLUSH_INTERVAL = 30.0
+
+DAILY_QUEST_COUNT = 3
+# Задания выдаются игрокам, у которых была игровая сессия за это время
+ACTIVE_PLAYER_TIME = datetime.timedelta(days=7)
+# Истекшие задания удаляются с задержкой: прогресс, присланный перед полуночью, переносится
+# в задания прошлого дня уже после нее (с большим запасом над QUEST_FLUSH_INTERVAL и QUEST_FLUSH_LOCK_TIME)
+QUEST_EXPIRY_GRACE = datetime.timedelta(hours=1)
+# Сколько живет предмет инвентаря, полученный за задание
+REWARD_ITEM_TIME = datetime.timedelta(days=30)
+
+def progressField(steamId: str, questId: int, period: datetime.datetime) -> str:
+    return f'{steamId}:{questId}:{period.date().isoformat()}'
+
+def parseProgressField(field: str) -> tuple[str, int, datetime.datetime]:
+    steamId, questId, period = field.rsplit(':', 2)
+    return steamId, int(questId), datetime.datetime.combine(datetime.date.fromisoformat(period), datetime.time())
+
+def questPeriodEnd(now: datetime.datetime) -> datetime.datetime:
+    """
+    Задания действуют до ближайшей полуночи
+    """
+    return datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
@@ -0,0 +1,131 @@
+from redis.asyncio import Redis
+from typing import Callable
+import asyncio
+import heapq
+import itertools
+import logging
+import uuid
+
+# Приоритеты запросов к ограниченному ресурсу: меньше - важнее
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Время берется из Redis (TIME), чтобы часы воркеров не влияли на лимит.
+# Возвращает 0, если токен получен, иначе сколько секунд ждать (строкой - Lua обрезает дробные числа)
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 + reserve then
+    tokens = tokens - 1
+else
+    wait = (1 + reserve - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+class TokenBucket:
+    """
+    Общий для всех воркеров token bucket в Redis: `rate` запросов в секунду, до `burst` подряд.
+    """
+    def __init__(self, key: str, rate: float, burst: int):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    async def take(self, redis: Redis, reserve: float = 0) -> float:
+        """
+        Пытается взять токен, оставив в ведре не меньше `reserve` токенов. Возвращает 0 или время ожидания в секундах
+        """
+        return float(await redis.eval(TOKEN_BUCKET_SCRIPT, 1, self.key, self.rate, self.burst, reserve)) # type: ignore
+
+class PriorityLimiter:
+    """
+    Очередь к TokenBucket с приоритетами.\n
+    Внутри процесса токены выдаются сначала INTERACTIVE запросам. Между воркерами приоритет
+    обеспечивается резервом: BACKGROUND запросы не берут последние `reserve` токенов ведра.
+    """
+    def __init__(self, bucket: TokenBucket, redisFactory: Callable[[], Redis], reserve: dict[int, float] | None = None):
+        self.bucket = bucket
+        self.redisFactory = redisFactory
+        self.reserve = reserve if reserve is not None else {INTERACTIVE: 0, BACKGROUND: bucket.burst / 4}
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.task: asyncio.Task | None = None
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.__dispatch())
+        await future
+
+    async def __dispatch(self):
+        redis = self.redisFactory()
+        while len(self.waiters) > 0:
+            priority, _, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            try:
+                wait = await self.bucket.take(redis, self.reserve.get(priority, 0))
+            except Exception as e:
+                # Без Redis лимит не проверить - запросы пропускаются, чтобы не останавливать API
+                logging.warning(f'Rate limiter {self.bucket.key} is unavailable: {str(e)}')
+                wait = 0
+            if wait == 0:
+                heapq.heappop(self.waiters)
+                if not future.done(): future.set_result(None)
+                continue
+            # Пока ждем токен, в очередь может встать более важный запрос - голова очереди проверяется заново
+            await asyncio.sleep(min(wait, 1))
+
+# Скользящее окно на ZSET: элементы - запросы, score - время в мс.
+# Запрос учитывается во всех окнах, только если ни одно не переполнено.
+# Возвращает {0, 0} или {номер переполненного окна (с 1), через сколько мс оно освободится}
+SLIDING_WINDOW_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        return {i, tonumber(oldest[2]) + window - now}
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, t[1] .. t[2] .. ARGV[1])
+    redis.call('PEXPIRE', key, ARGV[i * 2 + 1])
+end
+return {0, 0}
+"""
+
+class SlidingWindow:
+    """
+    Не больше `limit` событий за последние `window` секунд.
+    """
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+
+async def hitWindows(redis: Redis, windows: list[tuple[str, SlidingWindow]]) -> tuple[int, float]:
+    """
+    Учитывает событие сразу в нескольких окнах (ключ, окно) одним вызовом Redis.\n
+    Возвращает (0, 0), если событие разрешено, иначе (номер переполненного окна с 1, секунды до его освобождения)
+    """
+    args: list = [uuid.uuid4().hex]
+    for _, window in windows:
+        args += [window.limit, int(window.window * 1000)]
+    index, retryAfter = await redis.eval(SLIDING_WINDOW_SCRIPT, len(windows), *[key for key, _ in windows], *args) # type: ignore
+    return int(index), int(retryAfter) / 1000
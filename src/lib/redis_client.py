@@ -0,0 +1,17 @@
+from src.settings import REDIS_CONNECT_STRING, REDIS_DATABASE
+from redis import Redis as SyncRedis, ConnectionPool as SyncConnectionPool
+import redis.asyncio as aioredis # type: ignore
+
+# Пулы соединений API (воркер Celery использует свой пул в src.celery.tasks).
+# Вынесены из src.api.tools, чтобы src.lib не тянул за собой FastAPI
+
+def createRedisPool():
+    return aioredis.ConnectionPool.from_url(REDIS_CONNECT_STRING, encoding='utf-8', decode_responses=True, db=REDIS_DATABASE)
+redis_pool = createRedisPool()
+def getRedis():
+    return aioredis.Redis(connection_pool=redis_pool)
+
+# Для синхронных обработчиков (они выполняются в пуле потоков, async клиент там не использовать)
+sync_redis_pool = SyncConnectionPool.from_url(REDIS_CONNECT_STRING, encoding='utf-8', decode_responses=True, db=REDIS_DATABASE)
+def getSyncRedis():
+    return SyncRedis(connection_pool=sync_redis_pool)
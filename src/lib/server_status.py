@@ -0,0 +1,82 @@
+import datetime
+import hashlib
+import json
+
+# Ключи Redis, общие для Celery (пишет) и API (читает)
+
+SNAPSHOT_KEY = 'server_info:all'
+SNAPSHOT_ETAG_KEY = 'server_info:all:etag'
+UPDATES_CHANNEL = 'server_info:updates'
+SESSIONS_CHANNEL = 'server_info:sessions'
+ONLINE_KEY = 'server_info:online'
+
+DELTA_FIELDS = ('name', 'map', 'playersCount', 'maxPlayersCount')
+
+def serverInfoKey(sid: int) -> str:
+    return f'server_info:{sid}'
+
+def rosterKey(sid: int) -> str:
+    return f'server_roster:{sid}'
+
+def buildSnapshot(values: list[bytes | str | None]) -> tuple[bytes, str]:
+    """
+    Склеивает уже закодированные JSON объекты серверов в один JSON массив без повторной сериализации.\n
+    Возвращает (snapshot, etag)
+    """
+    parts = [v.encode() if isinstance(v, str) else v for v in values if v is not None]
+    snapshot = b'[' + b','.join(parts) + b']'
+    return snapshot, f'"{hashlib.md5(snapshot).hexdigest()}"'
+
+def etagMatches(ifNoneMatch: str | None, etag: str) -> bool:
+    if ifNoneMatch is None: return False
+    if ifNoneMatch.strip() == '*': return True
+    return etag in (t.strip().removeprefix('W/') for t in ifNoneMatch.split(','))
+
+def __playersKey(players: list[dict]) -> list[tuple]:
+    # Время в игре растет каждый опрос, поэтому состав сравнивается без него
+    return sorted((p['id'], p['steamId'], p['name']) for p in players)
+
+def serverDelta(previous: dict | None, current: dict) -> dict | None:
+    """
+    Возвращает только изменившиеся поля сервера (map, playersCount, players и т.д.) или None, если изменений нет.
+    """
+    if previous is None: return current
+    delta = {k: current[k] for k in DELTA_FIELDS if previous.get(k) != current[k]}
+    if __playersKey(previous.get('players', [])) != __playersKey(current['players']):
+        delta['players'] = current['players']
+    if len(delta) == 0: return None
+    delta['id'] = current['id']
+    delta['time'] = current['time']
+    return delta
+
+def diffRoster(previous: dict | None, players: list[dict], now: datetime.datetime) -> tuple[dict, list[dict], list[dict]]:
+    """
+    Сравнивает состав сервера с прошлым опросом.\n
+    roster: {'time': время опроса, 'players': {steamId: {'id', 'name', 'joinedAt'}}}\n
+    Возвращает (roster, joined, left). Вышедшим игрокам ставится leftAt - время прошлого опроса, в котором они еще были
+    """
+    before: dict[str, dict] = previous['players'] if previous is not None else {}
+    current: dict[str, dict] = {}
+    joined = []
+    for p in players:
+        if (known := before.get(p['steamId'])) is not None:
+            current[p['steamId']] = {**known, 'id': p['id']}
+            continue
+        # Время в игре из A2S точнее, чем время опроса (игрок мог зайти почти минуту назад)
+        joinedAt = now - datetime.timedelta(seconds=p['time'] or 0)
+        current[p['steamId']] = {'id': p['id'], 'name': p['name'], 'joinedAt': joinedAt.isoformat()}
+        joined.append({'steamId': p['steamId'], **current[p['steamId']]})
+    left = [
+        {'steamId': steamId, **p, 'leftAt': previous['time']} # type: ignore
+        for steamId, p in before.items() if steamId not in current
+    ]
+    return {'time': now.isoformat(), 'players': current}, joined, left
+
+def presenceEntries(sid: int, roster: dict) -> dict[str, str]:
+    """
+    Поля хэша ONLINE_KEY: {steamId: '{"sid", "id", "joinedAt"}'}
+    """
+    return {
+        steamId: json.dumps({'sid': sid, 'id': p.get('id'), 'joinedAt': p['joinedAt']})
+        for steamId, p in roster['players'].items()
+    }
@@ -1,6 +1,16 @@
 import a2s # type: ignore
+from a2s.info import InfoProtocol # type: ignore
+from a2s.players import PlayersProtocol # type: ignore
+from a2s.byteio import ByteReader # type: ignore
 from src.database.sourcebans import SbServer
 from dataclasses import dataclass
+import asyncio
+import bz2
+import io
+import logging
+import socket
+import struct
+import time
 
 # Не имеет смысла брать отсюда игроков из-за отсутствия Steam ID 
 
@@ -51,4 +61,154 @@ def getServerPlayers(server: SbServer) -> list[A2SPlayer]:
     return [
         A2SPlayer(i.index, i.name, i.score, i.duration) 
         for i in players
-    ]
\ No newline at end of file
+    ]
+
+
+A2S_CHALLENGE_RESPONSE = 0x41
+HEADER_SIMPLE = b'\xFF\xFF\xFF\xFF'
+HEADER_MULTI = b'\xFE\xFF\xFF\xFF'
+
+# Challenge номера серверов живут между циклами опроса (каждый цикл создает свой A2SEngine).
+# Устаревший challenge не ломает запрос: сервер пришлет новый и запрос повторится
+challengeCache: dict[tuple[str, int], int] = {}
+
+class A2SRequest:
+    def __init__(self, protocol, future: asyncio.Future):
+        self.protocol = protocol
+        self.future = future
+        self.sentAt = 0.0
+        self.ping: float | None = None
+        self.challenges = 0
+
+class A2SEngine(asyncio.DatagramProtocol):
+    """
+    Опрос всех серверов через один UDP сокет.\n
+    Ответы сопоставляются с запросами по адресу сервера и типу ответа, challenge номера кэшируются,
+    ответы из нескольких пакетов собираются по message id.\n
+    async with A2SEngine() as engine:
+        info, players = await asyncio.gather(engine.info(server), engine.players(server))
+    """
+    def __init__(self, timeout: float = 1.5, retries: int = 1, encoding: str = 'utf-8'):
+        self.timeout = timeout
+        self.retries = retries
+        self.encoding = encoding
+        self.pending: dict[tuple[tuple[str, int], int], A2SRequest] = {}
+        self.fragments: dict[tuple[tuple[str, int], int], dict[int, bytes]] = {}
+        self.addresses: dict[tuple[str, int], tuple[str, int]] = {}
+        self.transport: asyncio.DatagramTransport | None = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=('0.0.0.0', 0), family=socket.AF_INET)
+        return self
+
+    async def __aexit__(self, *args):
+        if self.transport is not None: self.transport.close()
+        for request in self.pending.values():
+            if not request.future.done(): request.future.cancel()
+
+    def connection_made(self, transport):
+        self.transport = transport # type: ignore
+
+    def error_received(self, exc):
+        # ICMP port unreachable и т.п. - запрос завершится по таймауту
+        logging.debug(f'A2S socket error: {str(exc)}')
+
+    def __send(self, address: tuple[str, int], request: A2SRequest):
+        assert self.transport is not None
+        request.sentAt = time.monotonic()
+        self.transport.sendto(HEADER_SIMPLE + request.protocol.serialize_request(challengeCache.get(address, 0)), address)
+
+    def datagram_received(self, data: bytes, addr):
+        address = (addr[0], addr[1])
+        if data.startswith(HEADER_SIMPLE):
+            self.__dispatch(address, data[4:])
+        elif data.startswith(HEADER_MULTI):
+            self.__fragment(address, data[4:])
+
+    def __fragment(self, address: tuple[str, int], data: bytes):
+        # Source формат: message id (4), количество пакетов (1), номер пакета (1), размер пакета (2)
+        if len(data) < 8: return
+        messageId, total, number, _ = struct.unpack('<IBBH', data[:8])
+        payload = data[8:]
+        compressed = bool(messageId & 0x80000000)
+        if compressed and number == 0:
+            payload = payload[8:] # размер после распаковки и crc32
+        parts = self.fragments.setdefault((address, messageId), {})
+        parts[number] = payload
+        if len(parts) < total: return
+        del self.fragments[(address, messageId)]
+        message = b''.join(parts[i] for i in range(total))
+        if compressed:
+            message = bz2.decompress(message)
+        if message.startswith(HEADER_SIMPLE):
+            message = message[4:]
+        self.__dispatch(address, message)
+
+    def __dispatch(self, address: tuple[str, int], message: bytes):
+        if len(message) == 0: return
+        responseType = message[0]
+        if responseType == A2S_CHALLENGE_RESPONSE:
+            if len(message) < 5: return
+            challengeCache[address] = struct.unpack('<I', message[1:5])[0]
+            # Challenge не говорит, на какой запрос он пришел, поэтому повторяются все ожидающие запросы к серверу
+            for (a, _), request in list(self.pending.items()):
+                if a != address or request.future.done(): continue
+                if request.ping is None: request.ping = time.monotonic() - request.sentAt
+                request.challenges += 1
+                if request.challenges > 3:
+                    request.future.set_exception(a2s.BrokenMessageError('Server keeps sending challenge responses'))
+                    continue
+                self.__send(address, request)
+            return
+        for (a, kind), request in self.pending.items():
+            if a != address or request.future.done() or not request.protocol.validate_response_type(responseType): continue
+            ping = request.ping if request.ping is not None else time.monotonic() - request.sentAt
+            reader = ByteReader(io.BytesIO(message[1:]), endian='<', encoding=self.encoding)
+            try:
+                request.future.set_result(request.protocol.deserialize_response(reader, responseType, ping))
+            except Exception as e:
+                request.future.set_exception(a2s.BrokenMessageError(f'Broken response from {address}: {str(e)}'))
+            return
+
+    async def __resolve(self, server: SbServer) -> tuple[str, int]:
+        key = (server.ip, server.port)
+        if key not in self.addresses:
+            info = await asyncio.get_running_loop().getaddrinfo(server.ip, server.port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            self.addresses[key] = info[0][4][:2]
+        return self.addresses[key]
+
+    async def __request(self, server: SbServer, protocol):
+        address = await self.__resolve(server) # type: ignore
+        key = (address, id(protocol))
+        if key in self.pending:
+            raise RuntimeError(f'Request to {address} is already running')
+        request = A2SRequest(protocol, asyncio.get_running_loop().create_future())
+        self.pending[key] = request
+        try:
+            for attempt in range(self.retries + 1):
+                self.__send(address, request)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(request.future), self.timeout)
+                except asyncio.TimeoutError:
+                    if attempt == self.retries: raise
+        finally:
+            del self.pending[key]
+
+    async def info(self, server: SbServer) -> A2SServer:
+        info = await self.__request(server, InfoProtocol)
+        return A2SServer(
+            info.server_name,
+            info.map_name,
+            info.player_count,
+            info.max_players,
+            info.ping,
+            keywords=info.keywords
+        )
+
+    async def players(self, server: SbServer) -> list[A2SPlayer]:
+        players = await self.__request(server, PlayersProtocol)
+        return [
+            A2SPlayer(i.index, i.name, i.score, i.duration)
+            for i in players
+        ]
@@ -1,7 +1,12 @@
-from src.settings import STEAM_TOKEN
+from src.settings import STEAM_TOKEN, STEAM_RATE_LIMIT, STEAM_RATE_BURST
 import httpx
 from pydantic_core import from_json
 from typing import TypedDict
+from src.lib.metrics import STEAM_LATENCY, STEAM_ERRORS, STEAM_RETRIES as STEAM_RETRIES_TOTAL
+from src.lib.rate_limit import TokenBucket, PriorityLimiter, INTERACTIVE, BACKGROUND
+from src.lib.redis_client import getRedis
+import asyncio
+import random
 
 class PlayerSummary(TypedDict):
     steamid: str
@@ -27,21 +32,70 @@ class PlayerSummary(TypedDict):
 key = STEAM_TOKEN
 host = 'https://api.steampowered.com'
 
-async def GetPlayerSummaries(steam_id: str) -> PlayerSummary:
-    async with httpx.AsyncClient() as session:
-        response = await session.get(f'{host}/ISteamUser/GetPlayerSummaries/v0002/?key={key}&steamids={steam_id}', timeout=30)
-        json = response.json()
-        if not json or not json['response'] or not json['response']['players'] or len(json['response']['players']) == 0:
-                raise Exception("Игрок не найден")
-        return json['response']['players'][0]
+STEAM_RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# Один лимит на все воркеры API: Steam отвечает 429 при всплесках запросов
+limiter = PriorityLimiter(TokenBucket('steam:ratelimit', STEAM_RATE_LIMIT, STEAM_RATE_BURST), getRedis)
+
+async def __get(method: str, url: str, priority: int = INTERACTIVE, **kwargs) -> dict:
+    """
+    GET запрос к Steam Web API через общий лимитер, с учетом в метриках (время ответа и ошибки).\n
+    429, 5xx и таймауты повторяются с экспоненциальной задержкой со случайным разбросом.
+    """
+    for attempt in range(STEAM_RETRIES + 1):
+        await limiter.acquire(priority)
+        async with httpx.AsyncClient() as session:
+            with STEAM_LATENCY.labels(method).time():
+                try:
+                    response = await session.get(url, **kwargs)
+                except httpx.TransportError as e:
+                    STEAM_ERRORS.labels(method, type(e).__name__).inc()
+                    if attempt == STEAM_RETRIES: raise
+                    delay = __backoff(attempt)
+                    response = None
+        if response is not None:
+            if response.status_code == 200:
+                return response.json()
+            STEAM_ERRORS.labels(method, str(response.status_code)).inc()
+            if response.status_code not in RETRY_STATUSES or attempt == STEAM_RETRIES:
+                response.raise_for_status()
+            delay = __retryAfter(response) or __backoff(attempt)
+        STEAM_RETRIES_TOTAL.labels(method).inc()
+        await asyncio.sleep(delay)
+    raise RuntimeError('unreachable')
+
+def __backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def __retryAfter(response: httpx.Response) -> float | None:
+    try:
+        return min(BACKOFF_MAX, float(response.headers['Retry-After']))
+    except (KeyError, ValueError):
+        return None
+
+async def GetPlayerSummaries(steam_id: str, priority: int = INTERACTIVE) -> PlayerSummary:
+    players = await GetPlayerSummariesBatch([steam_id], priority)
+    if len(players) == 0: raise Exception("Игрок не найден")
+    return players[0]
+
+async def GetPlayerSummariesBatch(steam_ids: list[str], priority: int = INTERACTIVE) -> list[PlayerSummary]:
+    """
+    Профили нескольких игроков одним запросом (Steam принимает до 100 SteamID). Ненайденных игроков в ответе нет.\n
+    Ответ без списка players - ошибка, а не "игроки не найдены" (иначе он закэшировался бы как отсутствующие профили)
+    """
+    json = await __get('GetPlayerSummaries', f'{host}/ISteamUser/GetPlayerSummaries/v0002/?key={key}&steamids={",".join(steam_ids)}', priority, timeout=30)
+    if not json or not isinstance(json.get('response'), dict) or not isinstance(json['response'].get('players'), list):
+        raise Exception('Unexpected GetPlayerSummaries response')
+    return json['response']['players']
 
 async def ResolveVanityURL(vanityURLName: str) -> str:
     """
     Возвращает SteamID по ссылке на профиль или чему-то еще.
     """
-    async with httpx.AsyncClient() as session:
-        response = await session.get(f'{host}/ISteamUser/ResolveVanityURL/v1?key={key}&vanityurl={vanityURLName}')
-        json = response.json()
-        if not json or not json['response'] or json['response']['success'] != 1:
-            raise Exception('Игрок не найден')
-        return json['response']['steamid']
+    json = await __get('ResolveVanityURL', f'{host}/ISteamUser/ResolveVanityURL/v1?key={key}&vanityurl={vanityURLName}')
+    if not json or not json['response'] or json['response']['success'] != 1:
+        raise Exception('Игрок не найден')
+    return json['response']['steamid']
@@ -0,0 +1,45 @@
+from typing import Any, Callable, Iterable
+import xml.etree.ElementTree as ET
+
+# Ключи Redis группы Steam, общие для Celery (parse_group пишет) и API (читает)
+
+GROUP_URL = 'https://steamcommunity.com/groups/vortexl4d4'
+
+GROUP_INFO_KEY = 'group_info'
+GROUP_UPDATES_CHANNEL = 'group_info:updates'
+GROUP_REFRESH_LOCK = 'group_info:refresh'
+
+GROUP_FRESH_TIME = 1800             # после этого данные отдаются, но обновляются
+GROUP_INFO_TTL = 7 * 86400          # сколько хранятся последние известные данные
+GROUP_REFRESH_LOCK_TIME = 120       # не больше одного обновления за это время
+GROUP_MEMBERS_KEY = 'group_members'
+GROUP_MAX_PAGES = 200
+
+PAGE_FIELDS = ('memberCount', 'membersInGame', 'membersOnline', 'totalPages', 'currentPage', 'nextPageLink')
+
+def parseMembersPage(chunks: Iterable[bytes], onMembers: Callable[[list[str]], Any], batch: int = 1000) -> dict[str, str]:
+    """
+    Потоковый разбор одной страницы memberslistxml: документ не собирается в памяти целиком,
+    SteamID участников передаются в `onMembers` пачками по `batch`.\n
+    Возвращает поля страницы (memberCount, membersInGame, membersOnline, totalPages, currentPage, nextPageLink)
+    """
+    parser = ET.XMLPullParser(events=('end',))
+    fields: dict[str, str] = {}
+    members: list[str] = []
+    def handle():
+        for _, element in parser.read_events():
+            if element.tag == 'steamID64' and element.text:
+                members.append(element.text.strip())
+                if len(members) >= batch:
+                    onMembers(members.copy())
+                    members.clear()
+            elif element.tag in PAGE_FIELDS and element.text:
+                fields[element.tag] = element.text.strip()
+            element.clear()
+    for chunk in chunks:
+        parser.feed(chunk)
+        handle()
+    parser.close()
+    handle()
+    if len(members) > 0: onMembers(members)
+    return fields
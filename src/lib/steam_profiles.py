@@ -0,0 +1,153 @@
+from src.lib.steam_api import PlayerSummary, GetPlayerSummariesBatch
+from src.lib.rate_limit import INTERACTIVE, BACKGROUND
+from src.lib.metrics import recordCache
+from redis.asyncio import Redis
+from collections import OrderedDict
+from dataclasses import dataclass
+import asyncio
+import logging
+import orjson
+import time
+
+PROFILE_FRESH_TIME = 86400          # после этого профиль отдается из кэша, но обновляется в фоне
+PROFILE_STALE_TIME = 7 * 86400      # сколько профиль хранится в Redis
+PROFILE_NEGATIVE_TIME = 600         # сколько помнить, что игрок не найден
+PROFILE_REFRESH_LOCK_TIME = 60
+LRU_SIZE = 4096
+STEAM_BATCH_SIZE = 100
+
+class ProfileNotFound(Exception):
+    ...
+
+@dataclass
+class CachedProfile:
+    fetchedAt: float
+    profile: PlayerSummary | None
+
+def profileKey(steamId: str) -> str:
+    return f'steam:{steamId}'
+
+class SteamProfileCache:
+    """
+    Кэш GetPlayerSummaries в два уровня: LRU в памяти процесса и Redis (`steam:{id}`).\n
+    - свежие профили отдаются из LRU без обращения к Redis
+    - устаревшие профили отдаются сразу и обновляются в фоне (stale-while-revalidate, один воркер на профиль)
+    - "игрок не найден" кэшируется на PROFILE_NEGATIVE_TIME
+    - промахи запрашиваются в Steam пачками по 100 SteamID
+    """
+    def __init__(self, size: int = LRU_SIZE, freshTime: float = PROFILE_FRESH_TIME,
+                 staleTime: float = PROFILE_STALE_TIME, negativeTime: float = PROFILE_NEGATIVE_TIME):
+        self.size = size
+        self.freshTime = freshTime
+        self.staleTime = staleTime
+        self.negativeTime = negativeTime
+        self.entries: OrderedDict[str, CachedProfile] = OrderedDict()
+        self.refreshing: set[str] = set()
+        self.tasks: set[asyncio.Task] = set()
+
+    def __fresh(self, entry: CachedProfile, now: float) -> bool:
+        return now - entry.fetchedAt < (self.freshTime if entry.profile is not None else self.negativeTime)
+
+    def __remember(self, steamId: str, entry: CachedProfile):
+        self.entries[steamId] = entry
+        self.entries.move_to_end(steamId)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __decode(self, raw: str | bytes, now: float) -> CachedProfile | None:
+        try:
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return None
+        if 'fetchedAt' not in data:
+            # Старый формат - профиль без времени загрузки, считается устаревшим
+            return CachedProfile(now - self.freshTime, data)
+        return CachedProfile(data['fetchedAt'], data['profile'])
+
+    async def __fetch(self, redis: Redis, steamIds: list[str], priority: int = INTERACTIVE) -> dict[str, CachedProfile]:
+        result: dict[str, CachedProfile] = {}
+        for i in range(0, len(steamIds), STEAM_BATCH_SIZE):
+            chunk = steamIds[i:i + STEAM_BATCH_SIZE]
+            try:
+                players = await GetPlayerSummariesBatch(chunk, priority)
+            except Exception as e:
+                # Ошибка Steam - это не "игрок не найден", такие профили не кэшируются
+                logging.warning(f'Failed to fetch Steam profiles: {str(e)}')
+                continue
+            now = time.time()
+            found = {p['steamid']: p for p in players}
+            pipe = redis.pipeline(transaction=False)
+            for steamId in chunk:
+                entry = CachedProfile(now, found.get(steamId))
+                result[steamId] = entry
+                self.__remember(steamId, entry)
+                pipe.set(
+                    profileKey(steamId), orjson.dumps({'fetchedAt': now, 'profile': entry.profile}),
+                    ex=self.staleTime if entry.profile is not None else self.negativeTime
+                )
+            await pipe.execute()
+        return result
+
+    async def __refresh(self, redis: Redis, steamIds: list[str]):
+        try:
+            pipe = redis.pipeline(transaction=False)
+            for steamId in steamIds:
+                pipe.set(f'steam_refresh:{steamId}', 1, nx=True, ex=PROFILE_REFRESH_LOCK_TIME)
+            locked = [s for s, ok in zip(steamIds, await pipe.execute()) if ok]
+            # Фоновое обновление уступает очередь к Steam запросам пользователей
+            if len(locked) > 0: await self.__fetch(redis, locked, BACKGROUND)
+        except Exception as e:
+            logging.warning(f'Failed to refresh Steam profiles: {str(e)}')
+        finally:
+            self.refreshing.difference_update(steamIds)
+
+    def __revalidate(self, redis: Redis, steamIds: list[str]):
+        self.refreshing.update(steamIds)
+        task = asyncio.create_task(self.__refresh(redis, steamIds))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def resolve(self, redis: Redis, steamIds: list[str]) -> tuple[dict[str, PlayerSummary], list[str]]:
+        """
+        ({steamId: профиль}, steamId, которые не удалось загрузить из Steam).\n
+        Ненайденных игроков нет ни там, ни там - отсутствие профиля в ответе Steam кэшируется как "не найден"
+        """
+        now = time.time()
+        unique = list(dict.fromkeys(steamIds))
+        found: dict[str, CachedProfile] = {}
+        for steamId in unique:
+            # Из LRU берутся только свежие записи: устаревшую мог уже обновить другой воркер
+            entry = self.entries.get(steamId)
+            hit = entry is not None and self.__fresh(entry, now)
+            recordCache(f'steam_lru:{steamId}', hit)
+            if hit:
+                self.entries.move_to_end(steamId)
+                found[steamId] = entry # type: ignore
+        remote = [s for s in unique if s not in found]
+        if len(remote) > 0:
+            for steamId, raw in zip(remote, await redis.mget([profileKey(s) for s in remote])):
+                recordCache(profileKey(steamId), raw is not None)
+                if raw is None or (entry := self.__decode(raw, now)) is None: continue
+                found[steamId] = entry
+                self.__remember(steamId, entry)
+        missing = [s for s in unique if s not in found]
+        if len(missing) > 0:
+            found.update(await self.__fetch(redis, missing))
+        stale = [s for s, e in found.items() if not self.__fresh(e, now) and s not in self.refreshing]
+        if len(stale) > 0:
+            self.__revalidate(redis, stale)
+        failed = [s for s in unique if s not in found]
+        return {s: e.profile for s, e in found.items() if e.profile is not None}, failed
+
+    async def getMany(self, redis: Redis, steamIds: list[str]) -> dict[str, PlayerSummary]:
+        """
+        {steamId: профиль}. Ненайденных игроков (и тех, кого не удалось загрузить из Steam) в результате нет
+        """
+        return (await self.resolve(redis, steamIds))[0]
+
+    async def get(self, redis: Redis, steamId: str) -> PlayerSummary:
+        profiles = await self.getMany(redis, [steamId])
+        if steamId not in profiles: raise ProfileNotFound(f'Steam profile {steamId} not found')
+        return profiles[steamId]
+
+steamProfiles = SteamProfileCache()
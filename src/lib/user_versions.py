@@ -0,0 +1,45 @@
+from redis import Redis
+import datetime
+import uuid
+
+# Ресурсы игрока, у которых есть версия (ETag) для условных GET запросов
+PERKS = 'perks'
+PRIVILEGE = 'privilege'
+BALANCE = 'balance'
+INVENTORY = 'inventory'
+
+VERSION_TTL = 86400
+
+# Версия - случайная строка, а не счетчик: после удаления ключа (bump, TTL, очистка Redis)
+# новая версия не может совпасть со старым ETag клиента
+def versionKey(resource: str, steamId: str) -> str:
+    return f'version:{resource}:{steamId}'
+
+def getVersion(r: Redis, resource: str, steamId: str) -> str:
+    """
+    Текущая версия ресурса игрока, создается при первом обращении.\n
+    Читать версию нужно до запроса к БД, а менять (bumpVersions) - после commit.
+    """
+    key = versionKey(resource, steamId)
+    version = r.get(key)
+    if version is None:
+        new = uuid.uuid4().hex[:16]
+        if r.set(key, new, nx=True, ex=VERSION_TTL): return new
+        # Версию успел создать параллельный запрос (или ее уже сбросили - тогда подойдет и своя)
+        version = r.get(key) or new
+    return version.decode() if isinstance(version, bytes) else str(version)
+
+def bumpVersions(r: Redis, resource: str, steamIds: list[str]):
+    """
+    Сбрасывает версии ресурса игроков после изменения данных.
+    """
+    if len(steamIds) == 0: return
+    r.delete(*[versionKey(resource, steamId) for steamId in steamIds])
+
+def expireVersionAt(r: Redis, resource: str, steamId: str, until: datetime.datetime | None):
+    """
+    Сбрасывает версию в момент `until` - например, когда истечет ближайшая привилегия, ответ изменится без записи в БД.
+    """
+    if until is None: return
+    limit = datetime.datetime.now(tz=until.tzinfo) + datetime.timedelta(seconds=VERSION_TTL)
+    r.expireat(versionKey(resource, steamId), min(until, limit))
@@ -10,6 +10,10 @@ REDIS_DATABASE: int = int(environ.get('REDIS_DATABASE')) #type: ignore
 SOURCEBANS_CONNECT_STRING: str = environ.get('SOURCEBANS_CONNECT_STRING') #type: ignore
 CELERY_BROKER_URL: str = environ.get('CELERY_BROKER_URL') #type: ignore
 CELERY_RESULT_BACKEND: str = environ.get('CELERY_RESULT_BACKEND') #type: ignore
+SQL_PROFILER: bool = environ.get('SQL_PROFILER', '0') == '1'
+STEAM_RATE_LIMIT: float = float(environ.get('STEAM_RATE_LIMIT', '5'))
+STEAM_RATE_BURST: int = int(environ.get('STEAM_RATE_BURST', '20'))
+CELERY_METRICS_PORT: int | None = int(environ['CELERY_METRICS_PORT']) if environ.get('CELERY_METRICS_PORT') else None
 
 assert SQL_CONNECT_STRING is not None, 'SQL_CONNECT_STRING not set in environment variables'
 assert STEAM_TOKEN is not None, 'STEAM_TOKEN not set in environment variables'
@@ -181,11 +181,13 @@ class SimpleQuest:
         name: str
         description: str
         rewardId: int
+        maxProgress: int = 1
     class Output(BaseModel):
         id: int
         name: str
         description: str
         reward: Reward.Output
+        maxProgress: int
 
 class DailyQuest:
     class Input(BaseModel):
@@ -199,8 +201,14 @@ class DailyQuest:
         activeUntil: datetime.datetime
         curProgress: int
         maxProgress: int
+        completedAt: datetime.datetime | None
         quest: SimpleQuest.Output
         rewards: list[Reward.Output]
+
+class QuestProgress(BaseModel):
+    steamId: str
+    questId: int
+    amount: int = 1
         
 
 class InventoryItem:
@@ -286,13 +294,38 @@ class ServerInfo(BaseModel):
     time: datetime.datetime
     players: list[ServerPlayer]
 
+class PlayerPresence(BaseModel):
+    steamId: str
+    sid: int
+    id: int | None = None
+    joinedAt: datetime.datetime
+
+class ServerStatsPoint(BaseModel):
+    time: datetime.datetime
+    avgPlayers: float
+    peakPlayers: int
+    maxPlayers: int
+    map: str
+
 class GroupInfo(BaseModel):
     membersCount: int
     membersInGame: int
     membersOnline: int
 
+class GroupMembership(BaseModel):
+    steamId: str
+    member: bool
+
 
 class PrivilegedUserInfo(BaseModel):
     steamId: str
     privilege: PrivilegeType
-    steamInfo: PlayerSummary
\ No newline at end of file
+    steamInfo: PlayerSummary
+class ValueCompareAndSet(BaseModel):
+    success: bool
+    value: int | str | None
+
+class ValueWatch(BaseModel):
+    key: str
+    value: int | str | None
+    changed: bool
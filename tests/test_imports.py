@@ -0,0 +1,35 @@
+import subprocess
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Бюджет на импорт с прогретым кэшем .pyc (с запасом для медленных машин, -X importtime сам добавляет накладные расходы)
+IMPORT_BUDGET = float(os.environ.get('IMPORT_BUDGET', '2.5'))
+
+
+def import_times(module: str) -> dict[str, int]:
+    """
+    {модуль: накопленное время импорта в мкс} по выводу python -X importtime
+    """
+    code = f'import {module}'
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, check=True, capture_output=True, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line: continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_api_imports():
+    times = import_times('main')
+    for module in ('numpy', 'celery', 'alembic', 'aiomysql'):
+        assert module not in times, module
+    assert times['main'] / 1e6 < IMPORT_BUDGET
+
+def test_worker_imports():
+    times = import_times('src.celery.tasks')
+    for module in ('numpy', 'fastapi', 'src.api', 'alembic'):
+        assert module not in times, module
+    assert times['src.celery.tasks'] / 1e6 < IMPORT_BUDGET
@@ -3,6 +3,7 @@ import pytest
 from dotenv import load_dotenv
 import os
 import datetime
+import asyncio
 
 load_dotenv(override=True)
 
@@ -15,8 +16,14 @@ os.environ['SQL_CONNECT_STRING'] = uri
 
 
 from fastapi.testclient import TestClient
+import src.settings as settings
+# Профилировщик включается до создания приложения (src.settings перечитывает .env, переменная окружения не подойдет)
+settings.SQL_PROFILER = True
+from src.bootstrap import createData
 from main import app
 
+createData()
+
 client = TestClient(app)
 client.headers['Authorization'] = f'Bearer {token}'
 perkset = {
@@ -319,4 +326,173 @@ def test_inventory():
     
     # Test inventory item deletion
     response = client.delete(f'inventory?inventory_item_id={inventoryItem["id"]}')
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_server_history():
+    r1 = client.get('/info/server/history?sid=1')
+    assert r1.status_code == 200
+    r2 = client.get('/info/server/history?sid=1&start=2024-01-01T00:00:00&end=2024-02-01T00:00:00')
+    assert r2.status_code == 200
+    r3 = client.get('/info/server/history?sid=1&resolution=5')
+    assert r3.status_code == 400
+
+def test_player_online():
+    r1 = client.get('/info/player/online?steam_id=test_offline')
+    assert r1.status_code == 404
+    r2 = client.post('/info/player/online', json=['test_offline', 'test_client'])
+    assert r2.status_code == 200
+    assert all(p['steamId'] in ('test_offline', 'test_client') for p in r2.json())
+    r3 = client.post('/info/player/online', json=[str(i) for i in range(501)])
+    assert r3.status_code == 400
+
+def test_group_member():
+    from src.lib.redis_client import getSyncRedis
+    from src.lib.steam_group import GROUP_MEMBERS_KEY
+    r = getSyncRedis()
+    r.sadd(GROUP_MEMBERS_KEY, 'test_group_member')
+    try:
+        r1 = client.get('/info/group/member?steam_id=test_group_member')
+        assert r1.json() == {'steamId': 'test_group_member', 'member': True}
+        r2 = client.post('/info/group/member', json=['test_group_member', 'test_client'])
+        assert [m['member'] for m in r2.json()] == [True, False]
+    finally:
+        r.srem(GROUP_MEMBERS_KEY, 'test_group_member')
+    r3 = client.post('/info/group/member', json=[str(i) for i in range(501)])
+    assert r3.status_code == 400
+
+def test_values_atomic():
+    client.delete('/values/int?key=test_counter')
+    assert client.post('/values/int/incr?key=test_counter&amount=5&max=7').json() == 5
+    assert client.post('/values/int/incr?key=test_counter&amount=5&max=7').json() == 7
+    assert client.post('/values/int/decr?key=test_counter&amount=10&min=0').json() == 0
+    r1 = client.post('/values/int/cas?key=test_counter&expected=0&value=3')
+    assert r1.json() == {'success': True, 'value': 3}
+    r2 = client.post('/values/int/cas?key=test_counter&expected=0&value=4')
+    assert r2.json() == {'success': False, 'value': 3}
+    from src.lib.redis_client import getSyncRedis
+    getSyncRedis().set('values_api:int:test_not_int', 'abc')
+    assert client.post('/values/int/cas?key=test_not_int&expected=0&value=1').status_code == 409
+    assert client.post('/values/int/incr?key=test_not_int').status_code == 409
+    client.post('/values/string/mset', json={'test_a': 'a', 'test_b': 'b'})
+    r3 = client.post('/values/string/mget', json=['test_a', 'test_b', 'test_missing'])
+    assert r3.json() == {'test_a': 'a', 'test_b': 'b', 'test_missing': None}
+
+def test_values_watch():
+    client.post('/values/int?key=test_watch&value=1')
+    r1 = client.get('/values/watch?key=test_watch&since=0')
+    assert r1.json() == {'key': 'test_watch', 'value': 1, 'changed': True}
+    r2 = client.get('/values/watch?key=test_watch&timeout=0')
+    assert r2.json()['changed'] is False
+
+def test_broadcaster_subscribe(monkeypatch):
+    import src.lib.redis_client as redis_client
+    from src.api.pubsub import RedisBroadcaster
+    async def run():
+        # Соединения пула привязаны к циклу событий, а здесь он свой
+        monkeypatch.setattr(redis_client, 'redis_pool', redis_client.createRedisPool())
+        broadcaster = RedisBroadcaster('test:broadcaster')
+        async with broadcaster.subscribe() as queue:
+            await redis_client.getRedis().publish('test:broadcaster', 'hello')
+            return await asyncio.wait_for(queue.get(), 5)
+    assert asyncio.run(run()) == 'hello'
+
+def test_rate_limit():
+    codes = [client.get('/balance/drop?steam_id=test_rate_limit').status_code for _ in range(6)]
+    assert codes[-1] == 429
+    r = client.get('/balance/drop?steam_id=test_rate_limit')
+    assert int(r.headers['Retry-After']) > 0
+
+def test_etag():
+    r1 = client.get('/balance?steam_id=test_client')
+    etag = r1.headers['ETag']
+    r2 = client.get('/balance?steam_id=test_client', headers={'If-None-Match': etag})
+    assert r2.status_code == 304
+    assert r2.headers['X-SQL-Count'] == '0'
+    client.post('/balance/add?steam_id=test_client&value=1')
+    r3 = client.get('/balance?steam_id=test_client', headers={'If-None-Match': etag})
+    assert r3.status_code == 200
+    assert r3.headers['ETag'] != etag
+
+
+def test_quests():
+    from src.celery.tasks import flush_quest_progress
+    item = client.post('/items/l4d2_item', json={'name': 'test_quest_item', 'command': 'give pills'}).json()
+    reward = client.post('/quests/reward', json={'name': 'test_reward', 'itemId': item['id'], 'privilegeItemId': None}).json()
+    assert client.post('/quests/simple', json={'name': 'test', 'description': 'test', 'rewardId': reward['id'], 'maxProgress': 3}).status_code == 200
+    steamId = f'test_quests_{datetime.datetime.now().timestamp()}'
+    quests = client.get(f'/quests?steam_id={steamId}').json()
+    assert len(quests) > 0
+    assert client.get(f'/quests?steam_id={steamId}').json() == quests
+    quest = quests[0]
+    progress = {'steamId': steamId, 'questId': quest['quest']['id'], 'amount': 1}
+    assert client.post('/quests/progress', json=[progress]).status_code == 200
+    assert client.get(f'/quests?steam_id={steamId}').json()[0]['curProgress'] == 1
+    client.post('/quests/progress', json=[{**progress, 'amount': quest['maxProgress']}])
+    flush_quest_progress()
+    done = client.get(f'/quests?steam_id={steamId}').json()[0]
+    assert done['curProgress'] == quest['maxProgress']
+    assert done['completedAt'] is not None
+    items = [r['item'] for r in quest['rewards'] if r['item'] is not None]
+    assert len(client.get(f'/inventory/items?steam_id={steamId}').json()) == len(items)
+    assert client.post('/quests/progress', json=[{**progress, 'amount': 0}]).status_code == 400
+
+
+def test_quests_progress_after_midnight():
+    from src.celery.tasks import flush_quest_progress, sweep_expired
+    from src.database.models import SessionLocal, DailyQuest, DailyQuests_Rewards, User
+    from src.lib.redis_client import getSyncRedis
+    from src.lib.quests import QUEST_PROGRESS_KEY, progressField
+    item = client.post('/items/l4d2_item', json={'name': 'test_quest_item', 'command': 'give pills'}).json()
+    reward = client.post('/quests/reward', json={'name': 'test_reward', 'itemId': item['id'], 'privilegeItemId': None}).json()
+    quest = client.post('/quests/simple', json={'name': 'test', 'description': 'test', 'rewardId': reward['id'], 'maxProgress': 2}).json()
+    steamId = f'test_quests_midnight_{datetime.datetime.now().timestamp()}'
+    client.get(f'/quests?steam_id={steamId}')
+    # Задание прошлого дня: прогресс прислан до полуночи, очистка и перенос - после
+    midnight = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.steamId == steamId).one()
+        db.add(dq := DailyQuest(userId=user.id, questId=quest['id'], maxProgress=2, curProgress=0, activeUntil=midnight))
+        db.flush()
+        db.add(DailyQuests_Rewards(dailyQuestId=dq.id, rewardId=reward['id']))
+        db.commit()
+    getSyncRedis().hincrby(QUEST_PROGRESS_KEY, progressField(steamId, quest['id'], midnight), 2)
+    sweep_expired()
+    flush_quest_progress()
+    items = client.get(f'/inventory/items?steam_id={steamId}').json()
+    assert item['id'] in [i['item']['id'] for i in items]
+
+def count_queries(path: str) -> int:
+    r = client.get(path)
+    assert r.status_code == 200
+    return int(r.headers['X-SQL-Count'])
+
+def uncached_queries(path: str, rkey: str) -> int:
+    from src.lib.redis_client import getSyncRedis
+    getSyncRedis().delete(rkey)
+    return count_queries(path)
+
+def test_donaters_query_count():
+    client.post('/privilege?steam_id=test_donater_0&privilege_id=6&until=2030-01-01T00:00:00')
+    before = uncached_queries('/info/donaters', 'info:donaters')
+    for i in range(1, 4):
+        client.post(f'/privilege?steam_id=test_donater_{i}&privilege_id={6 + i % 3}&until=2030-01-01T00:00:00')
+        client.post(f'/privilege?steam_id=test_donater_{i}&privilege_id=6&until=2020-01-01T00:00:00')
+    after = uncached_queries('/info/donaters', 'info:donaters')
+    assert before == after
+    assert uncached_queries('/info/team', 'info:team') == after
+
+
+def test_query_budgets():
+    client.post(f'/privilege?steam_id=test_client&privilege_id=6&until=2030-01-01T00:00:00')
+    client.post(f'/privilege?steam_id=test_client&privilege_id=7&until=2030-01-01T00:00:00')
+    budgets = {
+        '/privilege?steam_id=test_client': 5,
+        '/privilege/all?steam_id=test_client': 2,
+        '/perks?steam_id=test_client': 2,
+        '/privilege/types': 0,
+    }
+    for path, budget in budgets.items():
+        r = client.get(path)
+        assert r.status_code == 200
+        assert int(r.headers['X-SQL-Count']) <= budget, path
+        assert r.headers['X-SQL-N-Plus-One'] == '0', path